@@ -0,0 +1,5 @@
+"""Cursive Terminal analytics and telemetry"""
+
+from .telemetry_system import TelemetryCollector, default_collector, timed
+
+__all__ = ["TelemetryCollector", "default_collector", "timed"]
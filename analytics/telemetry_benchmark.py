@@ -0,0 +1,313 @@
+#!/usr/bin/env python3
+"""
+Cursive Terminal - Telemetry Benchmark
+Drives TelemetryCollector under load against a local stub endpoint and
+reports throughput, latency, database growth and report timings as JSON
+"""
+
+import argparse
+import gzip
+import json
+import multiprocessing
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Dict, List, Any
+
+# Also run as a script, so make the repository root importable for analytics
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from analytics.telemetry_system import LatencyHistogram, TelemetryCollector, zstandard
+
+class StubEndpoint:
+    """Local HTTP endpoint with configurable latency and failure rate"""
+    
+    def __init__(self, latency_ms: float = 0.0, failure_rate: float = 0.0):
+        self.latency_ms = latency_ms
+        self.failure_rate = failure_rate
+        self.requests = 0
+        self.failures = 0
+        self.events = 0
+        self.bytes = 0
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self._thread = threading.Thread(target=self._server.serve_forever,
+                                        name="stub-endpoint", daemon=True)
+    
+    @property
+    def url(self) -> str:
+        """Collection URL to hand to the collector"""
+        return f"http://127.0.0.1:{self._server.server_port}/collect"
+    
+    def _handler(self):
+        endpoint = self
+        
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                if endpoint.latency_ms:
+                    time.sleep(endpoint.latency_ms / 1000)
+                
+                if random.random() < endpoint.failure_rate:
+                    with endpoint._lock:
+                        endpoint.requests += 1
+                        endpoint.failures += 1
+                    self.send_response(503)
+                    self.end_headers()
+                    return
+                
+                count = endpoint.count_events(body, self.headers.get("Content-Encoding"))
+                with endpoint._lock:
+                    endpoint.requests += 1
+                    endpoint.events += count
+                    endpoint.bytes += len(body)
+                self.send_response(200)
+                self.end_headers()
+            
+            def log_message(self, format, *args):
+                pass
+        
+        return Handler
+    
+    @staticmethod
+    def count_events(body: bytes, encoding: str = None) -> int:
+        """Number of events in a json or batch protocol payload"""
+        if encoding == "gzip":
+            body = gzip.decompress(body)
+        elif encoding == "zstd" and zstandard is not None:
+            body = zstandard.ZstdDecompressor().decompressobj().decompress(body)
+        
+        payload = json.loads(body)
+        if "batches" in payload:
+            return sum(len(batch["events"]) for batch in payload["batches"])
+        return len(payload.get("events", []))
+    
+    def start(self) -> None:
+        self._thread.start()
+    
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+    
+    def stats(self) -> Dict[str, Any]:
+        """Requests, failures, events and bytes received so far"""
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "failures": self.failures,
+                "events": self.events,
+                "bytes": self.bytes
+            }
+
+def _database_size(config_dir: Path) -> int:
+    """Bytes on disk for the telemetry database including its WAL"""
+    return sum(
+        path.stat().st_size
+        for path in config_dir.glob("telemetry.db*")
+        if path.is_file()
+    )
+
+def _drive(collector: TelemetryCollector, events: int, rate: float,
+           worker: int) -> LatencyHistogram:
+    """Call track_event ``events`` times at up to ``rate`` per second"""
+    histogram = LatencyHistogram()
+    interval = 1.0 / rate if rate > 0 else 0.0
+    next_call = time.perf_counter()
+    
+    for i in range(events):
+        if interval:
+            delay = next_call - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            next_call += interval
+        
+        start = time.perf_counter_ns()
+        collector.track_event("benchmark", {"worker": worker, "sequence": i},
+                              font="Victor Mono")
+        histogram.record((time.perf_counter_ns() - start) / 1_000_000)
+    
+    return histogram
+
+def _process_worker(config_dir: str, endpoint: str, options: Dict[str, Any],
+                    worker: int, results: multiprocessing.Queue) -> None:
+    """Run one load generator in its own process with its own collector"""
+    collector = TelemetryCollector(endpoint=endpoint, config_dir=config_dir,
+                                   protocol=options["protocol"],
+                                   compression=options["compression"])
+    histogram = _drive(collector, options["events"], options["rate"], worker)
+    collector.flush(transmit=False)
+    collector.close()
+    results.put(histogram)
+
+def run_benchmark(workers: int = 4, mode: str = "thread", events: int = 10000,
+                  rate: float = 0.0, latency_ms: float = 0.0, failure_rate: float = 0.0,
+                  protocol: str = "json", compression: str = None,
+                  transmit_batch: int = 1000) -> Dict[str, Any]:
+    """Run one load scenario in a scratch config directory and return its results"""
+    config_dir = Path(tempfile.mkdtemp(prefix="telemetry-bench-"))
+    endpoint = StubEndpoint(latency_ms, failure_rate)
+    endpoint.start()
+    
+    try:
+        collector = TelemetryCollector(endpoint=endpoint.url, config_dir=str(config_dir),
+                                       protocol=protocol, compression=compression)
+        size_before = _database_size(config_dir)
+        latency = LatencyHistogram()
+        
+        # Load phase: events/sec as seen by callers of track_event
+        started = time.perf_counter()
+        if mode == "process":
+            results = multiprocessing.Queue()
+            options = {"events": events, "rate": rate,
+                       "protocol": protocol, "compression": compression}
+            processes = [
+                multiprocessing.Process(target=_process_worker,
+                                        args=(str(config_dir), endpoint.url, options, worker, results))
+                for worker in range(workers)
+            ]
+            for process in processes:
+                process.start()
+            for _ in processes:
+                latency.merge(results.get())
+            for process in processes:
+                process.join()
+        else:
+            histograms: List[LatencyHistogram] = []
+            threads = [
+                threading.Thread(target=lambda worker=worker: histograms.append(
+                    _drive(collector, events, rate, worker)))
+                for worker in range(workers)
+            ]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            for histogram in histograms:
+                latency.merge(histogram)
+        load_seconds = time.perf_counter() - started
+        
+        # Stop the background sender too, so the transmit phase below
+        # measures only explicit transmit_events calls
+        started = time.perf_counter()
+        collector.writer.close(transmit=False)
+        flush_seconds = time.perf_counter() - started
+        size_after = _database_size(config_dir)
+        queue = collector.database.get_queue_stats()
+        
+        started = time.perf_counter()
+        report = collector.generate_usage_report(30)
+        report_ms = (time.perf_counter() - started) * 1000
+        
+        # Transmit phase: drain the queue, giving up after repeated failures
+        received_before = endpoint.stats()["events"]
+        started = time.perf_counter()
+        attempts = failed = 0
+        collector.backoff.base_delay = collector.backoff.max_delay = 0
+        collector.backoff.failure_threshold = sys.maxsize
+        collector.backoff.record_success()
+        while collector.database.get_untransmitted_events(1) and failed < 50:
+            attempts += 1
+            if not collector.transmit_events(transmit_batch):
+                failed += 1
+        transmit_seconds = time.perf_counter() - started
+        received = endpoint.stats()
+        
+        collector.close()
+    finally:
+        endpoint.stop()
+        shutil.rmtree(config_dir, ignore_errors=True)
+    
+    # Rates and sizes are per event that reached the database; events the
+    # writer's buffer overflowed or the queue caps evicted are reported apart
+    tracked = workers * events
+    stored = report["total_events"]
+    dropped = sum(queue["dropped_events"].values())
+    return {
+        "scenario": {
+            "workers": workers,
+            "mode": mode,
+            "events_per_worker": events,
+            "rate_per_worker": rate,
+            "endpoint_latency_ms": latency_ms,
+            "endpoint_failure_rate": failure_rate,
+            "protocol": protocol,
+            "compression": compression,
+            "transmit_batch": transmit_batch
+        },
+        "drops": {
+            "events": dropped,
+            "rate": round(dropped / max(tracked, 1), 4)
+        },
+        "track_event": {
+            "calls": tracked,
+            "calls_per_sec": round(tracked / load_seconds, 1),
+            "stored_events_per_sec": round(stored / (load_seconds + flush_seconds), 1),
+            "latency_ms": latency.summary()
+        },
+        "storage": {
+            "flush_seconds": round(flush_seconds, 3),
+            "stored_events": stored,
+            "queue": queue,
+            "db_bytes_before": size_before,
+            "db_bytes_after": size_after,
+            "db_bytes_per_row": round((size_after - size_before) / max(queue["rows"], 1), 1)
+        },
+        "report": {
+            "generation_ms": round(report_ms, 3)
+        },
+        "transmit": {
+            "seconds": round(transmit_seconds, 3),
+            "attempts": attempts,
+            "failed_attempts": failed,
+            "events": received["events"] - received_before,
+            "events_per_sec": round((received["events"] - received_before) / transmit_seconds, 1)
+                              if transmit_seconds else 0.0,
+            "endpoint": received
+        }
+    }
+
+def main():
+    """Run a benchmark scenario and print or save the JSON results"""
+    parser = argparse.ArgumentParser(description="Cursive Terminal telemetry benchmark")
+    parser.add_argument("--workers", type=int, default=4, help="Concurrent load generators")
+    parser.add_argument("--mode", choices=["thread", "process"], default="thread",
+                        help="Run load generators as threads or processes")
+    parser.add_argument("--events", type=int, default=10000, help="Events per worker")
+    parser.add_argument("--rate", type=float, default=0.0,
+                        help="Events per second per worker (0 = unthrottled)")
+    parser.add_argument("--latency-ms", type=float, default=0.0,
+                        help="Stub endpoint response latency")
+    parser.add_argument("--failure-rate", type=float, default=0.0,
+                        help="Fraction of requests the stub endpoint rejects")
+    parser.add_argument("--protocol", choices=["json", "batch"], default="json")
+    parser.add_argument("--compression", choices=["gzip", "zstd"], default=None)
+    parser.add_argument("--transmit-batch", type=int, default=1000,
+                        help="Events per transmit_events call")
+    parser.add_argument("--output", help="Write results to this file instead of stdout")
+    args = parser.parse_args()
+    
+    results = run_benchmark(
+        workers=args.workers,
+        mode=args.mode,
+        events=args.events,
+        rate=args.rate,
+        latency_ms=args.latency_ms,
+        failure_rate=args.failure_rate,
+        protocol=args.protocol,
+        compression=args.compression,
+        transmit_batch=args.transmit_batch
+    )
+    
+    output = json.dumps(results, indent=2)
+    if args.output:
+        Path(args.output).write_text(output + "\n")
+        print(f"Results written to {args.output}")
+    else:
+        print(output)
+
+if __name__ == "__main__":
+    main()
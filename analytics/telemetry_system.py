@@ -4,18 +4,66 @@ Cursive Terminal - Privacy-First Analytics and Telemetry System
 Tracks usage patterns while respecting user privacy
 """
 
+import argparse
+import asyncio
+import atexit
+import csv
+import gzip
 import json
 import hashlib
+import importlib
+import inspect
+import math
 import uuid
-from datetime import datetime, timezone
+from datetime import datetime, timezone, timedelta
 import platform
+import random
 import subprocess
 import os
 from pathlib import Path
-from typing import Dict, List, Optional, Any
+from typing import Dict, List, Optional, Any, Callable, Iterator
 import requests
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from contextvars import ContextVar
 from dataclasses import dataclass, asdict
+from functools import cached_property, wraps
 import sqlite3
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+def _optional_module(name: str):
+    """Import a heavy optional dependency where it is used, None if missing"""
+    try:
+        return importlib.import_module(name)
+    except ImportError:
+        return None
+
+# Origin for the epoch-millisecond timestamps stored in the database
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+# One-byte tags identifying how stored event properties are encoded
+PROPERTIES_JSON = b"\x01"
+PROPERTIES_MSGPACK = b"\x02"
+
+# Name of the innermost timed operation, so nested spans record their path
+_current_span: ContextVar[Optional[str]] = ContextVar("telemetry_span", default=None)
 
 @dataclass
 class TelemetryEvent:
@@ -30,252 +78,2325 @@ class TelemetryEvent:
     properties: Dict[str, Any]
     version: str
 
+class SettingsFile:
+    """A JSON settings file held as an in-memory snapshot
+
+    The file is re-read only when its mtime or size changes, and checked
+    at most every ``check_interval`` seconds. Values found in the file are
+    merged over ``defaults`` (one level deep for nested dicts).
+    """
+    
+    def __init__(self, path: Path, defaults: Dict[str, Any], check_interval: float = 1.0):
+        self.path = path
+        self.defaults = defaults
+        self.check_interval = check_interval
+        
+        self._snapshot: Optional[Dict[str, Any]] = None
+        self._stamp: Optional[tuple] = None
+        self._next_check = 0.0
+    
+    def _file_stamp(self) -> Optional[tuple]:
+        """Identify the current version of the file"""
+        try:
+            stat = self.path.stat()
+        except OSError:
+            return None
+        return (stat.st_mtime_ns, stat.st_size)
+    
+    def _merge(self, values: Dict[str, Any]) -> Dict[str, Any]:
+        merged = {
+            key: dict(value) if isinstance(value, dict) else value
+            for key, value in self.defaults.items()
+        }
+        for key, value in values.items():
+            if isinstance(value, dict) and isinstance(merged.get(key), dict):
+                merged[key].update(value)
+            else:
+                merged[key] = value
+        return merged
+    
+    def current(self) -> Dict[str, Any]:
+        """Return the snapshot, reloading it if the file changed"""
+        now = time.monotonic()
+        if self._snapshot is not None and now < self._next_check:
+            return self._snapshot
+        
+        self._next_check = now + self.check_interval
+        stamp = self._file_stamp()
+        if self._snapshot is not None and stamp == self._stamp:
+            return self._snapshot
+        
+        values = {}
+        if stamp is not None:
+            try:
+                with open(self.path) as f:
+                    values = json.load(f)
+            except Exception:
+                pass
+        
+        self._snapshot = self._merge(values)
+        self._stamp = stamp
+        return self._snapshot
+    
+    def update(self, values: Dict[str, Any]) -> None:
+        """Merge values into the file and the snapshot"""
+        current = {
+            key: dict(value) if isinstance(value, dict) else value
+            for key, value in self.current().items()
+        }
+        for key, value in values.items():
+            if isinstance(value, dict) and isinstance(current.get(key), dict):
+                current[key] = {**current[key], **value}
+            else:
+                current[key] = value
+        
+        with open(self.path, 'w') as f:
+            json.dump(current, f, indent=2)
+        
+        self._snapshot = current
+        self._stamp = self._file_stamp()
+
 class PrivacyManager:
-    """Manages user privacy settings and data anonymization"""
+    """Manages user privacy settings and data anonymization
+
+    Privacy settings and telemetry volume limits are cached in memory and
+    re-read only when ``privacy.json`` / ``telemetry_limits.json`` change.
+    """
     
-    def __init__(self, config_dir: str = "~/.config/cursive-terminal"):
+    DEFAULT_SETTINGS = {
+        "analytics_enabled": True,
+        "error_reporting": True,
+        "usage_statistics": True,
+        "performance_metrics": True,
+        "font_popularity": True,
+        "terminal_detection": True,
+        "crash_reports": True,
+        "feature_usage": True
+    }
+    
+    # Per-category volume controls: "sampling" is the fraction of events
+    # kept, "rate_limits" a token bucket (events/second and burst size),
+    # and "aggregate" a window in seconds over which identical events are
+    # merged into one record (0 disables aggregation). Performance metrics
+    # are kept as histograms and need none of these.
+    DEFAULT_LIMITS = {
+        "sampling": {
+            "feature_usage": 1.0
+        },
+        "rate_limits": {
+            "feature_usage": {"rate": 50, "burst": 500}
+        },
+        "aggregate": {
+            "feature_usage": 0
+        }
+    }
+    
+    def __init__(self, config_dir: str = "~/.config/cursive-terminal",
+                 check_interval: float = 1.0):
         self.config_dir = Path(config_dir).expanduser()
         self.config_dir.mkdir(parents=True, exist_ok=True)
         self.privacy_file = self.config_dir / "privacy.json"
+        self.limits_file = self.config_dir / "telemetry_limits.json"
         self.user_id_file = self.config_dir / "user_id"
         
+        self._settings = SettingsFile(self.privacy_file, self.DEFAULT_SETTINGS, check_interval)
+        self._limits = SettingsFile(self.limits_file, self.DEFAULT_LIMITS, check_interval)
+        self._user_id: Optional[str] = None
+        
     def get_privacy_settings(self) -> Dict[str, bool]:
         """Get user privacy preferences"""
-        default_settings = {
-            "analytics_enabled": True,
-            "error_reporting": True,
-            "usage_statistics": True,
-            "performance_metrics": True,
-            "font_popularity": True,
-            "terminal_detection": True,
-            "crash_reports": True,
-            "feature_usage": True
+        return dict(self._settings.current())
+    
+    def is_enabled(self, category: str) -> bool:
+        """Check a single privacy setting against the cached snapshot"""
+        return self._settings.current().get(category, False)
+    
+    def update_privacy_settings(self, settings: Dict[str, bool]) -> None:
+        """Update user privacy preferences"""
+        self._settings.update(settings)
+    
+    def get_limit_settings(self) -> Dict[str, Any]:
+        """Get the cached sampling, rate limit and aggregation settings"""
+        return self._limits.current()
+    
+    def update_limit_settings(self, limits: Dict[str, Any]) -> None:
+        """Update sampling, rate limit and aggregation settings"""
+        self._limits.update(limits)
+    
+    def get_anonymous_user_id(self) -> str:
+        """Get or create anonymous user ID"""
+        if self._user_id is not None:
+            return self._user_id
+        
+        if self.user_id_file.exists():
+            try:
+                with open(self.user_id_file) as f:
+                    self._user_id = f.read().strip()
+                    return self._user_id
+            except Exception:
+                pass
+        
+        # Create new anonymous ID
+        user_id = str(uuid.uuid4())
+        try:
+            with open(self.user_id_file, 'w') as f:
+                f.write(user_id)
+        except Exception:
+            pass
+        
+        self._user_id = user_id
+        return user_id
+    
+    def hash_identifier(self, identifier: str) -> str:
+        """Create a privacy-safe hash of an identifier"""
+        return hashlib.sha256(identifier.encode()).hexdigest()[:16]
+
+class SystemDetector:
+    """Detects system information for telemetry
+
+    The static ``detect_*``/``get_*`` methods always probe the system. The
+    ``cached_*`` methods memoize expensive results in a small JSON file,
+    keyed by terminal session (terminal) or font directory mtime (fonts)
+    and expiring after ``ttl`` seconds.
+    """
+    
+    TERMINAL_VARS = [
+        ("TERM_PROGRAM", {
+            "iTerm.app": "iTerm2",
+            "Apple_Terminal": "Terminal.app",
+            "vscode": "VS Code Terminal",
+            "Hyper": "Hyper"
+        }),
+        ("TERMINAL_EMULATOR", {
+            "JetBrains-JediTerm": "JetBrains Terminal"
+        })
+    ]
+    
+    TERMINAL_PROCESSES = [
+        ("alacritty", "Alacritty"),
+        ("warp", "Warp"),
+        ("kitty", "Kitty")
+    ]
+    
+    FONT_DIR = Path.home() / "Library" / "Fonts"
+    
+    def __init__(self, cache_file: str = "~/.config/cursive-terminal/system_cache.json",
+                 ttl: float = 24 * 60 * 60):
+        self.cache_file = Path(cache_file).expanduser()
+        self.ttl = ttl
+        self._cache: Optional[Dict[str, Any]] = None
+    
+    @staticmethod
+    def get_platform_info() -> Dict[str, str]:
+        """Get basic platform information"""
+        return {
+            "os": platform.system(),
+            "os_version": platform.release(),
+            "arch": platform.machine(),
+            "python_version": platform.python_version()
+        }
+    
+    @staticmethod
+    def _terminal_from_env() -> Optional[str]:
+        """Identify the terminal from environment variables"""
+        for var, mapping in SystemDetector.TERMINAL_VARS:
+            value = os.environ.get(var)
+            if value in mapping:
+                return mapping[value]
+        return None
+    
+    @staticmethod
+    def _proc_stat(pid: int) -> Optional[tuple]:
+        """(ppid, command name) of one process from /proc, None if unreadable"""
+        try:
+            stat = Path(f"/proc/{pid}/stat").read_text()
+        except OSError:
+            return None
+        # The command name is parenthesised and may contain spaces
+        name = stat[stat.find("(") + 1:stat.rfind(")")]
+        fields = stat[stat.rfind(")") + 2:].split()
+        return int(fields[1]), name.lower()
+    
+    @staticmethod
+    def _process_table() -> Dict[int, tuple]:
+        """Map pid -> (ppid, command name) for systems without procfs"""
+        # One ps call listing only pid, ppid and name
+        table = {}
+        result = subprocess.run(['ps', '-axo', 'pid=,ppid=,comm='],
+                                capture_output=True, text=True)
+        for line in result.stdout.splitlines():
+            parts = line.split(None, 2)
+            if len(parts) == 3 and parts[0].isdigit() and parts[1].isdigit():
+                table[int(parts[0])] = (int(parts[1]), parts[2].lower())
+        return table
+    
+    @staticmethod
+    def _terminal_from_processes() -> Optional[str]:
+        """Identify the terminal from this process's ancestors"""
+        try:
+            # With procfs only the ancestors' stat files are read
+            if Path("/proc/self/stat").exists():
+                lookup = SystemDetector._proc_stat
+            else:
+                lookup = SystemDetector._process_table().get
+            
+            pid = os.getppid()
+            seen = set()
+            while pid > 0 and pid not in seen:
+                seen.add(pid)
+                entry = lookup(pid)
+                if entry is None:
+                    break
+                ppid, name = entry
+                for needle, terminal in SystemDetector.TERMINAL_PROCESSES:
+                    if needle in name:
+                        return terminal
+                pid = ppid
+        except Exception:
+            pass
+        
+        return None
+    
+    @staticmethod
+    def detect_terminal() -> Optional[str]:
+        """Detect which terminal is being used"""
+        return (SystemDetector._terminal_from_env()
+                or SystemDetector._terminal_from_processes()
+                or os.environ.get("TERM", "Unknown"))
+    
+    @staticmethod
+    def get_font_info() -> Dict[str, Any]:
+        """Get information about installed fonts"""
+        font_info = {
+            "victor_mono": False,
+            "cascadia_code": False,
+            "jetbrains_mono": False,
+            "fira_code": False,
+            "total_fonts": 0
         }
         
-        if self.privacy_file.exists():
+        font_dir = SystemDetector.FONT_DIR
+        if font_dir.exists():
+            fonts = list(font_dir.glob("*.otf")) + list(font_dir.glob("*.ttf"))
+            font_info["total_fonts"] = len(fonts)
+            
+            font_names = [f.name.lower() for f in fonts]
+            font_info["victor_mono"] = any("victormono" in name for name in font_names)
+            font_info["cascadia_code"] = any("cascadia" in name for name in font_names)
+            font_info["jetbrains_mono"] = any("jetbrains" in name for name in font_names)
+            font_info["fira_code"] = any("fira" in name for name in font_names)
+        
+        return font_info
+    
+    @staticmethod
+    def get_boot_id() -> Optional[str]:
+        """Identify the current boot, if the platform exposes it"""
+        try:
+            return Path("/proc/sys/kernel/random/boot_id").read_text().strip()
+        except OSError:
+            pass
+        
+        # macOS: "{ sec = 1700000000, usec = 123456 } Tue Nov 14 ..."
+        try:
+            result = subprocess.run(['sysctl', '-n', 'kern.boottime'],
+                                    capture_output=True, text=True, timeout=2)
+        except (OSError, subprocess.SubprocessError):
+            return None
+        return result.stdout.split("}")[0].strip(" {") or None
+    
+    @staticmethod
+    def get_session_key() -> Optional[list]:
+        """Identify this process's terminal session
+
+        The session leader is normally the shell the terminal started, so
+        its pid and (where procfs exposes it) start time change with the
+        terminal window or tab.
+        """
+        try:
+            sid = os.getsid(0)
+        except OSError:
+            return None
+        
+        try:
+            stat = Path(f"/proc/{sid}/stat").read_text()
+            start_time = stat[stat.rfind(")") + 2:].split()[19]
+        except (OSError, IndexError):
+            start_time = None
+        return [sid, start_time]
+    
+    def _load_cache(self) -> Dict[str, Any]:
+        if self._cache is None:
+            try:
+                with open(self.cache_file) as f:
+                    self._cache = json.load(f)
+            except Exception:
+                self._cache = {}
+        return self._cache
+    
+    def _save_cache(self) -> None:
+        try:
+            self.cache_file.parent.mkdir(parents=True, exist_ok=True)
+            tmp_file = self.cache_file.with_suffix(".tmp")
+            with open(tmp_file, 'w') as f:
+                json.dump(self._cache, f)
+            os.replace(tmp_file, self.cache_file)
+        except Exception:
+            pass
+    
+    def _cached(self, name: str, key: Any, compute: Callable[[], Any]) -> Any:
+        """Return a cached value if its key matches and it has not expired"""
+        cache = self._load_cache()
+        entry = cache.get(name)
+        if (entry and entry.get("key") == key
+                and time.time() - entry.get("created", 0) < self.ttl):
+            return entry["value"]
+        
+        value = compute()
+        cache[name] = {"key": key, "created": time.time(), "value": value}
+        self._save_cache()
+        return value
+    
+    def cached_terminal(self) -> Optional[str]:
+        """Detect the terminal, caching the process scan per terminal session"""
+        terminal = self._terminal_from_env()
+        if terminal:
+            return terminal
+        
+        # The scan walks this process's ancestors, so the answer is only
+        # reusable by processes started from the same session
+        boot_id, session = self.get_boot_id(), self.get_session_key()
+        if boot_id is None or session is None:
+            terminal = self._terminal_from_processes()
+        else:
+            terminal = self._cached("terminal", [boot_id, *session],
+                                    self._terminal_from_processes)
+        return terminal or os.environ.get("TERM", "Unknown")
+    
+    def cached_font_info(self) -> Dict[str, Any]:
+        """Get font information, cached until the font directory changes"""
+        try:
+            font_dir_mtime = self.FONT_DIR.stat().st_mtime_ns
+        except OSError:
+            font_dir_mtime = None
+        
+        return self._cached("font_info", font_dir_mtime, self.get_font_info)
+
+class LatencyHistogram:
+    """Log-bucketed latency histogram with roughly 9% relative precision
+
+    Bucket ``i`` counts durations in ``(BASE**(i - 1), BASE**i]``
+    milliseconds, giving eight buckets per doubling. Percentiles report a
+    bucket's upper bound, capped at the largest value seen.
+    """
+    
+    BASE = 2 ** (1 / 8)
+    MIN_VALUE = 0.001
+    
+    def __init__(self):
+        self.buckets: Dict[int, int] = {}
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.failures = 0
+    
+    @classmethod
+    def bucket_index(cls, value: float) -> int:
+        """Index of the bucket holding a duration in milliseconds"""
+        return math.ceil(math.log(max(value, cls.MIN_VALUE), cls.BASE))
+    
+    @classmethod
+    def bucket_bound(cls, index: int) -> float:
+        """Upper bound in milliseconds of a bucket"""
+        return cls.BASE ** index
+    
+    def record(self, value: float, success: bool = True, count: int = 1) -> None:
+        """Add a duration in milliseconds"""
+        index = self.bucket_index(value)
+        self.buckets[index] = self.buckets.get(index, 0) + count
+        self.count += count
+        self.total += value * count
+        self.max = max(self.max, value)
+        if not success:
+            self.failures += count
+    
+    def merge(self, other: "LatencyHistogram") -> None:
+        """Add another histogram's samples to this one"""
+        for index, count in other.buckets.items():
+            self.buckets[index] = self.buckets.get(index, 0) + count
+        self.count += other.count
+        self.total += other.total
+        self.max = max(self.max, other.max)
+        self.failures += other.failures
+    
+    def percentile(self, percent: float) -> float:
+        """Approximate duration below which ``percent`` of samples fall"""
+        if not self.count:
+            return 0.0
+        
+        rank = math.ceil(self.count * percent / 100)
+        seen = 0
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if seen >= rank:
+                return min(self.bucket_bound(index), self.max)
+        return self.max
+    
+    def summary(self) -> Dict[str, Any]:
+        """Count, mean, p50/p90/p99, max and failures"""
+        return {
+            "count": self.count,
+            "mean": round(self.total / self.count, 3) if self.count else 0.0,
+            "p50": round(self.percentile(50), 3),
+            "p90": round(self.percentile(90), 3),
+            "p99": round(self.percentile(99), 3),
+            "max": round(self.max, 3),
+            "failures": self.failures
+        }
+
+class LocalDatabase:
+    """Local SQLite database for storing telemetry before transmission
+
+    A single long-lived connection is kept per process (reopened after a
+    fork) in WAL mode, so storing an event is one cached INSERT rather than
+    a file open, schema lookup and fsync.
+    """
+    
+    # Low-cardinality strings are stored once in the strings table and
+    # referenced by integer id; properties are a tagged binary blob.
+    # weight is the number of original events a pre-aggregated or sampled
+    # row stands for, fractional for sampling rates like 0.3. The event
+    # time is only kept as UTC epoch milliseconds; ISO-8601 strings and
+    # rollup buckets are derived from it.
+    CREATE_EVENTS_SQL = """
+        CREATE TABLE events (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            event_type TEXT NOT NULL,
+            timestamp_ms INTEGER NOT NULL,
+            session_ref INTEGER NOT NULL,
+            user_ref INTEGER NOT NULL,
+            platform_ref INTEGER NOT NULL,
+            terminal_ref INTEGER,
+            font TEXT,
+            properties BLOB,
+            version_ref INTEGER NOT NULL,
+            feature TEXT,
+            weight REAL NOT NULL DEFAULT 1
+        )
+    """
+    
+    INSERT_EVENT_SQL = """
+        INSERT INTO events (
+            event_type, timestamp_ms, session_ref, user_ref, platform_ref,
+            terminal_ref, font, properties, version_ref, feature, weight
+        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    """
+    
+    # Rows copied out of a pre-migration table keep their ids
+    COPY_EVENT_SQL = """
+        INSERT INTO events (
+            id, event_type, timestamp_ms, session_ref, user_ref, platform_ref,
+            terminal_ref, font, properties, version_ref, feature, weight
+        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    """
+    
+    # Events are acknowledged with a high-water mark: every id at or below
+    # the ack_cursor metadata value has been transmitted
+    SELECT_UNTRANSMITTED_SQL = """
+        SELECT * FROM events 
+        WHERE id > COALESCE((SELECT CAST(value AS INTEGER) FROM metadata WHERE key = 'ack_cursor'), 0)
+        ORDER BY id ASC 
+        LIMIT ?
+    """
+    
+    ACKNOWLEDGE_SQL = """
+        INSERT INTO metadata (key, value) VALUES ('ack_cursor', ?)
+        ON CONFLICT(key) DO UPDATE SET value = MAX(CAST(value AS INTEGER), CAST(excluded.value AS INTEGER))
+    """
+    
+    # Ids grow with time, so expired events form a prefix of the table:
+    # everything before the first row newer than the cutoff, capped at the
+    # ack cursor. Finding that row walks the rowid b-tree from the start and
+    # stops at the first match, and the delete is a single rowid range, so
+    # cleanup costs O(expired rows) however large the table is. A row that
+    # arrived out of order waits for a later pass.
+    CLEANUP_SQL = """
+        DELETE FROM events
+        WHERE id <= MIN(
+            COALESCE((SELECT CAST(value AS INTEGER) FROM metadata WHERE key = 'ack_cursor'), 0),
+            COALESCE(
+                (SELECT id FROM events NOT INDEXED WHERE timestamp_ms >= ? ORDER BY id LIMIT 1) - 1,
+                (SELECT MAX(id) FROM events),
+                0
+            )
+        )
+    """
+    
+    # Lower values are evicted first when the queue is over its caps;
+    # unlisted event types use DEFAULT_EVICTION_PRIORITY
+    EVICTION_PRIORITY = {
+        "performance": 0,
+        "feature_usage": 1,
+        "terminal_configuration": 2,
+        "font_installation": 2,
+        "error": 9,
+        "crash_report": 9
+    }
+    DEFAULT_EVICTION_PRIORITY = 1
+    LIMIT_CHECK_INTERVAL = 1000
+    
+    def __init__(self, db_path: str = "~/.config/cursive-terminal/telemetry.db",
+                 synchronous: str = "NORMAL", cached_statements: int = 128,
+                 max_rows: int = 100000, max_bytes: int = 50 * 1024 * 1024,
+                 busy_timeout: float = 30.0):
+        self.db_path = Path(db_path).expanduser()
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self.synchronous = synchronous.upper()
+        self.cached_statements = cached_statements
+        self.busy_timeout = busy_timeout
+        self.max_rows = max_rows
+        self.max_bytes = max_bytes
+        
+        self._lock = threading.RLock()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._conn_pid: Optional[int] = None
+        self._row_count = 0
+        self._inserts_since_check = 0
+        self._string_ids: Dict[str, int] = {}
+        self._string_values: Dict[int, str] = {}
+        self._backfills_pending = False
+        
+        self.init_database()
+    
+    def __enter__(self) -> "LocalDatabase":
+        return self
+    
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.close()
+    
+    def _connect(self) -> sqlite3.Connection:
+        """Open and configure the process-wide connection"""
+        conn = sqlite3.connect(
+            self.db_path,
+            check_same_thread=False,
+            cached_statements=self.cached_statements,
+            # Other processes share the file; wait for their write locks
+            timeout=self.busy_timeout
+        )
+        conn.row_factory = sqlite3.Row
+        # Only takes effect on a new database; see init_database
+        conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(f"PRAGMA synchronous={self.synchronous}")
+        return conn
+    
+    @contextmanager
+    def transaction(self, immediate: bool = False) -> Iterator[sqlite3.Connection]:
+        """Yield the shared connection inside a locked transaction
+
+        ``immediate`` takes the database write lock up front, so a
+        read-then-write sequence cannot interleave with another process.
+        """
+        with self._lock:
+            # A forked child must not reuse the parent's connection
+            if self._conn is None or self._conn_pid != os.getpid():
+                self._conn = self._connect()
+                self._conn_pid = os.getpid()
+            
+            try:
+                with self._conn:
+                    if immediate:
+                        self._conn.execute("BEGIN IMMEDIATE")
+                    yield self._conn
+            except Exception:
+                # Interned string ids may belong to the rolled-back transaction
+                self._string_ids.clear()
+                self._string_values.clear()
+                raise
+    
+    def close(self) -> None:
+        """Close the shared connection; it is reopened on next use"""
+        with self._lock:
+            if self._conn is not None and self._conn_pid == os.getpid():
+                self._conn.close()
+            self._conn = None
+            self._conn_pid = None
+    
+    # Schema migrations in order; PRAGMA user_version records how many
+    # have been applied. Each runs in its own write transaction. Databases
+    # from before versioning start at 0, either empty or with the original
+    # inline-string events table. Append new steps, never reorder.
+    MIGRATIONS = [
+        "_migrate_core_schema"
+    ]
+    
+    # Methods converting one id range, run after the migration that
+    # schedules them so large tables are converted without a long lock
+    BACKFILLS = {
+        "legacy_events": "_copy_legacy_events"
+    }
+    
+    BACKFILL_KEY = "pending_backfills"
+    
+    def init_database(self) -> None:
+        """Initialize the local database"""
+        self.migrate()
+        
+        with self.transaction() as conn:
+            self._row_count = conn.execute("SELECT COUNT(*) FROM events").fetchone()[0]
+            self._backfills_pending = bool(self._pending_backfills(conn))
+    
+    def schema_version(self) -> int:
+        """Number of migrations applied to the database"""
+        with self.transaction() as conn:
+            return conn.execute("PRAGMA user_version").fetchone()[0]
+    
+    def migrate(self) -> int:
+        """Apply pending migrations; returns the resulting schema version"""
+        version = self.schema_version()
+        
+        for number, name in enumerate(self.MIGRATIONS, 1):
+            if number <= version:
+                continue
+            
+            with self.transaction(immediate=True) as conn:
+                # Another process may have migrated while we waited
+                if conn.execute("PRAGMA user_version").fetchone()[0] >= number:
+                    continue
+                getattr(self, name)(conn)
+                conn.execute(f"PRAGMA user_version = {number}")
+            version = number
+        
+        return version
+    
+    def _migrate_core_schema(self, conn: sqlite3.Connection) -> None:
+        """1: events, interned strings, metadata, rollups and histograms"""
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS metadata (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL
+            )
+        """)
+        
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS strings (
+                id INTEGER PRIMARY KEY,
+                value TEXT NOT NULL UNIQUE
+            )
+        """)
+        
+        columns = self._table_columns(conn, "events")
+        if "session_id" in columns:
+            self._upgrade_legacy_events(conn)
+        elif not columns:
+            conn.execute(self.CREATE_EVENTS_SQL)
+        
+        # Only time-bounded exports use this; reports read the rollups
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_timestamp_ms ON events(timestamp_ms)")
+        
+        # Counts sum event weights, so sampled categories are fractional
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS rollups (
+                granularity TEXT NOT NULL,
+                bucket TEXT NOT NULL,
+                dimension TEXT NOT NULL,
+                value TEXT NOT NULL,
+                count REAL NOT NULL,
+                PRIMARY KEY (granularity, bucket, dimension, value)
+            ) WITHOUT ROWID
+        """)
+        
+        # Hourly latency histograms, matching the rollups' finest bucket;
+        # the sent_* columns record how much of each counter has already
+        # been shipped as a delta
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS histograms (
+                hour TEXT NOT NULL,
+                operation TEXT NOT NULL,
+                bucket INTEGER NOT NULL,
+                count INTEGER NOT NULL,
+                sent INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (hour, operation, bucket)
+            ) WITHOUT ROWID
+        """)
+        
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS histogram_stats (
+                hour TEXT NOT NULL,
+                operation TEXT NOT NULL,
+                count INTEGER NOT NULL,
+                total REAL NOT NULL,
+                max REAL NOT NULL,
+                failures INTEGER NOT NULL,
+                sent_count INTEGER NOT NULL DEFAULT 0,
+                sent_total REAL NOT NULL DEFAULT 0,
+                sent_failures INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (hour, operation)
+            ) WITHOUT ROWID
+        """)
+    
+    @staticmethod
+    def _table_columns(conn: sqlite3.Connection, table: str) -> set:
+        return {row["name"] for row in conn.execute(f"PRAGMA table_info({table})")}
+    
+    def _pending_backfills(self, conn: sqlite3.Connection) -> Dict[str, Dict[str, int]]:
+        row = conn.execute("SELECT value FROM metadata WHERE key = ?",
+                           (self.BACKFILL_KEY,)).fetchone()
+        return json.loads(row["value"]) if row else {}
+    
+    def _schedule_backfill(self, conn: sqlite3.Connection, name: str, end_id: int) -> None:
+        """Queue a backfill over ids up to ``end_id``"""
+        pending = self._pending_backfills(conn)
+        pending[name] = {"next_id": 0, "end_id": end_id}
+        conn.execute("""
+            INSERT INTO metadata (key, value) VALUES (?, ?)
+            ON CONFLICT(key) DO UPDATE SET value = excluded.value
+        """, (self.BACKFILL_KEY, json.dumps(pending)))
+        self._backfills_pending = True
+    
+    def run_backfills(self, max_chunks: Optional[int] = None, chunk_size: int = 5000) -> bool:
+        """Advance pending backfills by up to ``max_chunks`` chunks
+
+        Each chunk of ``chunk_size`` ids commits on its own, so writers and
+        readers interleave with a long backfill. Returns True once nothing
+        is left to do.
+        """
+        if not self._backfills_pending:
+            return True
+        
+        chunks = 0
+        while max_chunks is None or chunks < max_chunks:
+            with self.transaction(immediate=True) as conn:
+                pending = self._pending_backfills(conn)
+                if not pending:
+                    self._backfills_pending = False
+                    return True
+                
+                name, progress = next(iter(pending.items()))
+                upper = min(progress["next_id"] + chunk_size, progress["end_id"])
+                getattr(self, self.BACKFILLS[name])(conn, progress["next_id"], upper)
+                
+                if upper >= progress["end_id"]:
+                    del pending[name]
+                else:
+                    progress["next_id"] = upper
+                
+                if pending:
+                    conn.execute("UPDATE metadata SET value = ? WHERE key = ?",
+                                 (json.dumps(pending), self.BACKFILL_KEY))
+                else:
+                    conn.execute("DELETE FROM metadata WHERE key = ?", (self.BACKFILL_KEY,))
+            chunks += 1
+        
+        return False
+    
+    def _upgrade_legacy_events(self, conn: sqlite3.Connection) -> None:
+        """Set aside an events table that stores every string inline
+
+        The table is renamed to events_legacy and copied into the new
+        layout by the ``legacy_events`` backfill, a chunk at a time.
+        Until the copy finishes, transmission and reports read both tables.
+        """
+        # Delivery was tracked with the transmitted flag: acknowledge
+        # everything below the first untransmitted row
+        cursor = conn.execute("""
+            SELECT COALESCE(
+                (SELECT MIN(id) - 1 FROM events WHERE transmitted = FALSE),
+                (SELECT MAX(id) FROM events),
+                0
+            )
+        """).fetchone()[0]
+        conn.execute(self.ACKNOWLEDGE_SQL, (cursor,))
+        
+        # The sequence row moves with the rename; keep AUTOINCREMENT from
+        # reusing ids at or below the ack cursor in the new table
+        row = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'events'").fetchone()
+        last_id = row["seq"] if row else 0
+        
+        conn.execute("ALTER TABLE events RENAME TO events_legacy")
+        conn.execute("DROP INDEX IF EXISTS idx_transmitted")
+        conn.execute(self.CREATE_EVENTS_SQL)
+        conn.execute("INSERT INTO sqlite_sequence (name, seq) VALUES ('events', ?)", (last_id,))
+        
+        end_id = conn.execute("SELECT COALESCE(MAX(id), 0) FROM events_legacy").fetchone()[0]
+        self._schedule_backfill(conn, "legacy_events", end_id)
+    
+    @staticmethod
+    def _legacy_event(row: sqlite3.Row) -> TelemetryEvent:
+        """Event stored in a pre-migration events_legacy row"""
+        return TelemetryEvent(
+            event_type=row["event_type"],
+            timestamp=row["timestamp"],
+            session_id=row["session_id"],
+            user_id_hash=row["user_id_hash"],
+            platform=row["platform"],
+            terminal=row["terminal"],
+            font=row["font"],
+            properties=json.loads(row["properties"]) if row["properties"] else {},
+            version=row["version"]
+        )
+    
+    def _copy_legacy_events(self, conn: sqlite3.Connection, after_id: int, up_to_id: int) -> None:
+        """Move one id range of events_legacy into the events table"""
+        rows = conn.execute("""
+            SELECT * FROM events_legacy WHERE id > ? AND id <= ?
+        """, (after_id, up_to_id)).fetchall()
+        events = [self._legacy_event(row) for row in rows]
+        
+        conn.executemany(self.COPY_EVENT_SQL, [
+            (
+                row["id"],
+                event.event_type,
+                self.epoch_ms(event.timestamp),
+                self._string_id(conn, event.session_id),
+                self._string_id(conn, event.user_id_hash),
+                self._string_id(conn, event.platform),
+                self._string_id(conn, event.terminal),
+                event.font,
+                self.encode_properties(event.properties),
+                self._string_id(conn, event.version),
+                self._event_feature(event),
+                self._event_weight(event)
+            )
+            for row, event in zip(rows, events)
+        ])
+        self._update_rollups(conn, events)
+        self._row_count += len(events)
+        
+        conn.execute("DELETE FROM events_legacy WHERE id > ? AND id <= ?", (after_id, up_to_id))
+        if not conn.execute("SELECT 1 FROM events_legacy LIMIT 1").fetchone():
+            conn.execute("DROP TABLE events_legacy")
+    
+    def _has_legacy_events(self, conn: sqlite3.Connection) -> bool:
+        """Whether rows are still waiting in events_legacy"""
+        return self._backfills_pending and bool(conn.execute("""
+            SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'events_legacy'
+        """).fetchone())
+    
+    def _legacy_untransmitted(self, conn: sqlite3.Connection, limit: int) -> List[Dict[str, Any]]:
+        """Unsent events still waiting in events_legacy"""
+        rows = conn.execute("""
+            SELECT * FROM events_legacy
+            WHERE id > COALESCE((SELECT CAST(value AS INTEGER) FROM metadata WHERE key = 'ack_cursor'), 0)
+            ORDER BY id ASC
+            LIMIT ?
+        """, (limit,)).fetchall()
+        return [
+            {"id": row["id"], **asdict(self._legacy_event(row))}
+            for row in rows
+        ]
+    
+    def _legacy_summary(self, conn: sqlite3.Connection, hour: str) -> List[tuple]:
+        """(dimension, value, count) rows for events_legacy from ``hour`` on"""
+        return conn.execute("""
+            SELECT 'event_type', event_type, COUNT(*) FROM events_legacy
+            WHERE timestamp >= ? GROUP BY 2
+            UNION ALL
+            SELECT 'font', font, COUNT(*) FROM events_legacy
+            WHERE timestamp >= ? AND font != '' GROUP BY 2
+            UNION ALL
+            SELECT 'terminal', terminal, COUNT(*) FROM events_legacy
+            WHERE timestamp >= ? AND terminal != '' GROUP BY 2
+            UNION ALL
+            SELECT 'feature', COALESCE(json_extract(properties, '$.feature'), 'unknown'), COUNT(*)
+            FROM events_legacy
+            WHERE timestamp >= ? AND event_type = 'feature_usage' GROUP BY 2
+            UNION ALL
+            SELECT 'error_type', COALESCE(json_extract(properties, '$.error_type'), 'unknown'), COUNT(*)
+            FROM events_legacy
+            WHERE timestamp >= ? AND event_type = 'error' GROUP BY 2
+        """, (hour,) * 5).fetchall()
+    
+    @staticmethod
+    def encode_properties(properties: Dict[str, Any]) -> bytes:
+        """Encode event properties as a tagged msgpack (or compact JSON) blob"""
+        if msgpack is not None:
+            return PROPERTIES_MSGPACK + msgpack.packb(properties, use_bin_type=True)
+        return PROPERTIES_JSON + json.dumps(properties, separators=(",", ":")).encode()
+    
+    @staticmethod
+    def decode_properties(raw: Any) -> Dict[str, Any]:
+        """Decode stored properties in any of the supported encodings"""
+        if raw is None:
+            return {}
+        if isinstance(raw, str):
+            # JSON text written before binary encoding was introduced
+            return json.loads(raw)
+        
+        tag, body = raw[:1], raw[1:]
+        if tag == PROPERTIES_MSGPACK:
+            return msgpack.unpackb(body, raw=False)
+        return json.loads(body)
+    
+    def _string_id(self, conn: sqlite3.Connection, value: Optional[str]) -> Optional[int]:
+        """Intern a string in the strings table"""
+        if value is None:
+            return None
+        
+        string_id = self._string_ids.get(value)
+        if string_id is None:
+            conn.execute("INSERT OR IGNORE INTO strings (value) VALUES (?)", (value,))
+            string_id = conn.execute("SELECT id FROM strings WHERE value = ?", (value,)).fetchone()[0]
+            self._string_ids[value] = string_id
+            self._string_values[string_id] = value
+        return string_id
+    
+    def _string_value(self, conn: sqlite3.Connection, string_id: Optional[int]) -> Optional[str]:
+        """Resolve an interned string id"""
+        if string_id is None:
+            return None
+        
+        value = self._string_values.get(string_id)
+        if value is None:
+            value = conn.execute("SELECT value FROM strings WHERE id = ?", (string_id,)).fetchone()[0]
+            self._string_ids[value] = string_id
+            self._string_values[string_id] = value
+        return value
+    
+    def _decode_event(self, conn: sqlite3.Connection, row: sqlite3.Row) -> Dict[str, Any]:
+        """Expand a stored row back into plain event fields"""
+        return {
+            "id": row["id"],
+            "event_type": row["event_type"],
+            "timestamp": self.iso_timestamp(row["timestamp_ms"]),
+            "session_id": self._string_value(conn, row["session_ref"]),
+            "user_id_hash": self._string_value(conn, row["user_ref"]),
+            "platform": self._string_value(conn, row["platform_ref"]),
+            "terminal": self._string_value(conn, row["terminal_ref"]),
+            "font": row["font"],
+            "properties": self.decode_properties(row["properties"]),
+            "version": self._string_value(conn, row["version_ref"])
+        }
+    
+    @staticmethod
+    def epoch_ms(value: str) -> int:
+        """Milliseconds since the epoch for an ISO-8601 date or timestamp
+
+        Values without an offset are taken to be UTC.
+        """
+        moment = datetime.fromisoformat(value)
+        if moment.tzinfo is None:
+            moment = moment.replace(tzinfo=timezone.utc)
+        return (moment - EPOCH) // timedelta(milliseconds=1)
+    
+    @staticmethod
+    def iso_timestamp(timestamp_ms: int) -> str:
+        """UTC ISO-8601 timestamp, to the millisecond, for epoch milliseconds"""
+        return (EPOCH + timedelta(milliseconds=timestamp_ms)).isoformat(timespec="milliseconds")
+    
+    def store_event(self, event: TelemetryEvent) -> None:
+        """Store an event in the local database"""
+        self.store_events([event])
+    
+    def store_events(self, events: List[TelemetryEvent]) -> None:
+        """Store a batch of events in a single transaction"""
+        if not events:
+            return
+        
+        with self.transaction() as conn:
+            conn.executemany(self.INSERT_EVENT_SQL, [
+                (
+                    event.event_type,
+                    self.epoch_ms(event.timestamp),
+                    self._string_id(conn, event.session_id),
+                    self._string_id(conn, event.user_id_hash),
+                    self._string_id(conn, event.platform),
+                    self._string_id(conn, event.terminal),
+                    event.font,
+                    self.encode_properties(event.properties),
+                    self._string_id(conn, event.version),
+                    self._event_feature(event),
+                    self._event_weight(event)
+                )
+                for event in events
+            ])
+            self._update_rollups(conn, events)
+            self._row_count += len(events)
+            self._inserts_since_check += len(events)
+        
+        # Byte usage is only measured every LIMIT_CHECK_INTERVAL inserts
+        if self._row_count > self.max_rows or self._inserts_since_check >= self.LIMIT_CHECK_INTERVAL:
+            self.enforce_limits()
+    
+    ROLLUP_UPSERT_SQL = """
+        INSERT INTO rollups (granularity, bucket, dimension, value, count)
+        VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT(granularity, bucket, dimension, value)
+        DO UPDATE SET count = count + excluded.count
+    """
+    
+    # (dimension, SQL expression) pairs used when rebuilding from raw events
+    ROLLUP_DIMENSIONS = [
+        ("event_type", "event_type"),
+        ("font", "NULLIF(font, '')"),
+        ("terminal", "NULLIF((SELECT value FROM strings WHERE id = terminal_ref), '')"),
+        ("feature", "feature")
+    ]
+    
+    @staticmethod
+    def _rollup_values(event: TelemetryEvent) -> List[tuple]:
+        """(dimension, value) pairs an event contributes to the rollups"""
+        values = [("event_type", event.event_type)]
+        if event.font:
+            values.append(("font", event.font))
+        if event.terminal:
+            values.append(("terminal", event.terminal))
+        if event.event_type == "feature_usage":
+            values.append(("feature", LocalDatabase._event_feature(event)))
+        elif event.event_type == "error":
+            values.append(("error_type", event.properties.get("error_type", "unknown")))
+        return values
+    
+    def _update_rollups(self, conn: sqlite3.Connection, events: List[TelemetryEvent]) -> None:
+        """Add a batch of events to the hourly and daily rollups"""
+        counts: Dict[tuple, int] = {}
+        for event in events:
+            # Normalised to UTC: the first 13 chars are the hour, 10 the day
+            stamp = self.iso_timestamp(self.epoch_ms(event.timestamp))
+            hour, day = stamp[:13], stamp[:10]
+            weight = self._event_weight(event)
+            for dimension, value in self._rollup_values(event):
+                for key in (("hour", hour, dimension, value), ("day", day, dimension, value)):
+                    counts[key] = counts.get(key, 0) + weight
+        
+        conn.executemany(self.ROLLUP_UPSERT_SQL,
+                         [(*key, count) for key, count in counts.items()])
+    
+    def rebuild_rollups(self) -> None:
+        """Recompute the rollups from raw events
+
+        History for raw events that have already been pruned is lost, so
+        this is meant for repairing or initialising the rollups.
+        """
+        self.run_backfills()
+        with self.transaction() as conn:
+            self._rebuild_rollups(conn)
+    
+    def _rebuild_rollups(self, conn: sqlite3.Connection) -> None:
+        conn.execute("DELETE FROM rollups")
+        for granularity, pattern in (("hour", "%Y-%m-%dT%H"), ("day", "%Y-%m-%d")):
+            for dimension, expression in self.ROLLUP_DIMENSIONS:
+                conn.execute(f"""
+                    INSERT INTO rollups (granularity, bucket, dimension, value, count)
+                    SELECT ?, strftime('{pattern}', timestamp_ms / 1000, 'unixepoch'), ?,
+                           {expression}, SUM(weight)
+                    FROM events
+                    WHERE {expression} IS NOT NULL
+                    GROUP BY 2, 4
+                """, (granularity, dimension))
+        
+        # Error types live inside the encoded properties
+        counts: Dict[tuple, int] = {}
+        for row in conn.execute("""
+            SELECT timestamp_ms, properties, weight FROM events WHERE event_type = 'error'
+        """):
+            error_type = self.decode_properties(row["properties"]).get("error_type", "unknown")
+            stamp = self.iso_timestamp(row["timestamp_ms"])
+            for key in (("hour", stamp[:13]), ("day", stamp[:10])):
+                key += ("error_type", error_type)
+                counts[key] = counts.get(key, 0) + row["weight"]
+        conn.executemany(self.ROLLUP_UPSERT_SQL,
+                         [(*key, count) for key, count in counts.items()])
+        
+        # Performance samples only survive as hourly histograms
+        for granularity, length in (("hour", 13), ("day", 10)):
+            conn.execute(f"""
+                INSERT INTO rollups (granularity, bucket, dimension, value, count)
+                SELECT ?, substr(hour, 1, {length}), 'event_type', 'performance', SUM(count)
+                FROM histogram_stats
+                GROUP BY 2
+                ON CONFLICT(granularity, bucket, dimension, value)
+                DO UPDATE SET count = count + excluded.count
+            """, (granularity,))
+    
+    @staticmethod
+    def _event_weight(event: TelemetryEvent) -> float:
+        """Number of original events a (possibly aggregated) event stands for
+
+        An event kept at ``sample_rate`` r stands for 1/r events, so the
+        rollups estimate real usage rather than the sampled fraction.
+        """
+        aggregate = event.properties.get("aggregate")
+        weight = int(aggregate.get("count", 1)) if isinstance(aggregate, dict) else 1
+        sample_rate = event.properties.get("sample_rate")
+        if isinstance(sample_rate, (int, float)) and 0 < sample_rate < 1:
+            return weight / sample_rate
+        return weight
+    
+    @staticmethod
+    def _event_feature(event: TelemetryEvent) -> Optional[str]:
+        """Feature name denormalized into its own column for reporting"""
+        if event.event_type != "feature_usage":
+            return None
+        return event.properties.get("feature", "unknown")
+    
+    def get_untransmitted_events(self, limit: int = 100) -> List[Dict]:
+        """Get events that haven't been transmitted yet"""
+        with self.transaction() as conn:
+            return self._untransmitted(conn, limit)
+    
+    def _untransmitted(self, conn: sqlite3.Connection, limit: int) -> List[Dict]:
+        rows = conn.execute(self.SELECT_UNTRANSMITTED_SQL, (limit,)).fetchall()
+        events = [self._decode_event(conn, row) for row in rows]
+        if self._has_legacy_events(conn):
+            # Copied and uncopied rows interleave by id until the copy ends
+            events = sorted(events + self._legacy_untransmitted(conn, limit),
+                            key=lambda event: event["id"])[:limit]
+        return events
+    
+    EXPORT_COLUMNS = [
+        "id", "event_type", "timestamp", "session_id", "user_id_hash", "platform",
+        "terminal", "font", "version", "properties"
+    ]
+    
+    def iter_events(self, since: str = None, until: str = None,
+                    event_types: List[str] = None,
+                    chunk_size: int = 1000) -> Iterator[List[Dict[str, Any]]]:
+        """Yield stored events ``chunk_size`` at a time
+
+        ``since``/``until`` bound the UTC ISO-8601 timestamp (a date such as
+        ``2024-05-01`` works too; ``until`` is exclusive). Time-bounded reads
+        walk the timestamp index in (timestamp, id) order so only matching
+        rows are visited; unbounded ones go in id order. Chunks are fetched
+        by keyset, so memory stays constant and the database lock is not
+        held between chunks. A pending legacy copy is finished first.
+        """
+        self.run_backfills()
+        
+        conditions, params = [], []
+        if since:
+            conditions.append("timestamp_ms >= ?")
+            params.append(self.epoch_ms(since))
+        if until:
+            conditions.append("timestamp_ms < ?")
+            params.append(self.epoch_ms(until))
+        
+        ordered_by_time = bool(conditions)
+        if event_types:
+            conditions.append(f"event_type IN ({', '.join('?' * len(event_types))})")
+            params.extend(event_types)
+        
+        if ordered_by_time:
+            keyset, order = "(timestamp_ms, id) > (?, ?)", "timestamp_ms, id"
+        else:
+            keyset, order = "id > ?", "id"
+        
+        sql = f"""
+            SELECT * FROM events
+            WHERE {' AND '.join([keyset] + conditions)}
+            ORDER BY {order} LIMIT ?
+        """
+        position = (-1, 0) if ordered_by_time else (0,)
+        while True:
+            with self.transaction() as conn:
+                rows = conn.execute(sql, (*position, *params, chunk_size)).fetchall()
+                last = rows[-1] if rows else None
+                chunk = [self._decode_event(conn, row) for row in rows]
+            if not chunk:
+                return
+            
+            position = (last["timestamp_ms"], last["id"]) if ordered_by_time else (last["id"],)
+            yield chunk
+    
+    def export_events(self, path: str, format: str = "ndjson", since: str = None,
+                      until: str = None, event_types: List[str] = None,
+                      chunk_size: int = 10000) -> int:
+        """Stream matching events to a file; returns the number written
+
+        ``format`` is ``ndjson``, ``parquet``, ``csv`` or ``columnar`` (Parquet
+        when pyarrow is installed, CSV otherwise). In the columnar formats
+        ``properties`` is a JSON string column. Each chunk becomes one
+        Parquet row group, so only one chunk is in memory at a time.
+        """
+        pyarrow = None
+        if format in ("columnar", "parquet"):
+            pyarrow = _optional_module("pyarrow")
+            if pyarrow is not None:
+                importlib.import_module("pyarrow.parquet")
+        if format == "columnar":
+            format = "parquet" if pyarrow is not None else "csv"
+        if format == "parquet" and pyarrow is None:
+            raise RuntimeError("Parquet export requires pyarrow")
+        if format not in ("ndjson", "parquet", "csv"):
+            raise ValueError(f"Unknown export format: {format}")
+        
+        chunks = self.iter_events(since, until, event_types, chunk_size)
+        written = 0
+        
+        if format == "parquet":
+            schema = pyarrow.schema([
+                (column, pyarrow.int64() if column == "id" else pyarrow.string())
+                for column in self.EXPORT_COLUMNS
+            ])
+            with pyarrow.parquet.ParquetWriter(path, schema, compression="zstd") as writer:
+                for chunk in chunks:
+                    for event in chunk:
+                        event["properties"] = json.dumps(event["properties"])
+                    writer.write_table(pyarrow.Table.from_pylist(chunk, schema=schema))
+                    written += len(chunk)
+            return written
+        
+        with open(path, "w", newline="") as f:
+            if format == "csv":
+                writer = csv.DictWriter(f, fieldnames=self.EXPORT_COLUMNS)
+                writer.writeheader()
+            
+            for chunk in chunks:
+                for event in chunk:
+                    if format == "csv":
+                        event["properties"] = json.dumps(event["properties"], separators=(",", ":"))
+                        writer.writerow(event)
+                    else:
+                        f.write(json.dumps(event, separators=(",", ":")) + "\n")
+                written += len(chunk)
+        
+        return written
+    
+    LEASE_KEY = "send_lease"
+    
+    def claim_batch(self, limit: int = 100, lease_seconds: float = 120.0) -> Optional[Dict[str, Any]]:
+        """Lease the next unsent events and histogram deltas for transmission
+
+        Returns ``{"lease_id", "events", "histograms"}``, or None while
+        another process holds an unexpired lease. An expired lease is taken
+        over, so a crashed sender only delays its batch.
+        """
+        lease_id = uuid.uuid4().hex
+        with self.transaction(immediate=True) as conn:
+            row = conn.execute("SELECT value FROM metadata WHERE key = ?",
+                               (self.LEASE_KEY,)).fetchone()
+            if row and json.loads(row["value"])["expires"] > time.time():
+                return None
+            
+            events = self._untransmitted(conn, limit)
+            histograms = self._histogram_deltas(conn)
+            
+            if events or histograms:
+                conn.execute("""
+                    INSERT INTO metadata (key, value) VALUES (?, ?)
+                    ON CONFLICT(key) DO UPDATE SET value = excluded.value
+                """, (self.LEASE_KEY, json.dumps({
+                    "id": lease_id,
+                    "expires": time.time() + lease_seconds,
+                    "pid": os.getpid()
+                })))
+        
+        return {"lease_id": lease_id, "events": events, "histograms": histograms}
+    
+    def complete_batch(self, batch: Dict[str, Any], sent: bool) -> bool:
+        """Release a leased batch, acknowledging it if it was sent
+
+        Returns False if the lease had been taken over by another process.
+        Sent events are still acknowledged then, since the cursor only moves
+        forward, but the histogram deltas are left to the new holder.
+        """
+        with self.transaction(immediate=True) as conn:
+            row = conn.execute("SELECT value FROM metadata WHERE key = ?",
+                               (self.LEASE_KEY,)).fetchone()
+            owned = bool(row) and json.loads(row["value"])["id"] == batch["lease_id"]
+            
+            if sent:
+                if batch["events"]:
+                    conn.execute(self.ACKNOWLEDGE_SQL, (batch["events"][-1]["id"],))
+                if owned:
+                    self._acknowledge_histograms(conn, batch["histograms"])
+            
+            if owned:
+                conn.execute("DELETE FROM metadata WHERE key = ?", (self.LEASE_KEY,))
+        return owned
+    
+    def acknowledge(self, up_to_id: int) -> None:
+        """Mark every event with id <= up_to_id as transmitted"""
+        with self.transaction() as conn:
+            conn.execute(self.ACKNOWLEDGE_SQL, (up_to_id,))
+    
+    def get_ack_cursor(self) -> int:
+        """Highest event id acknowledged by the endpoint"""
+        return int(self.get_metadata("ack_cursor", 0))
+    
+    def mark_transmitted(self, event_ids: List[int]) -> None:
+        """Mark events as transmitted
+
+        Batches come from get_untransmitted_events in id order, so
+        acknowledging the largest id covers the whole batch.
+        """
+        if not event_ids:
+            return
+        
+        self.acknowledge(max(event_ids))
+    
+    def cleanup_old_events(self, days_old: int = 30) -> None:
+        """Remove old transmitted events
+
+        Reports are served from the rollups, so raw rows only need to be
+        kept until they have been transmitted. Latency histograms older
+        than the cutoff are dropped once shipped. A database created before
+        incremental auto-vacuum is converted here, with a one-off VACUUM.
+        """
+        # Finish a pending legacy copy so its rows are pruned too
+        self.run_backfills()
+        
+        with self.transaction() as conn:
+            cutoff = int((time.time() - days_old * 24 * 60 * 60) * 1000)
+            deleted = conn.execute(self.CLEANUP_SQL, (cutoff,)).rowcount
+            self._row_count = max(0, self._row_count - deleted)
+            
+            cutoff_hour = datetime.fromtimestamp(cutoff / 1000, timezone.utc).isoformat()[:13]
+            conn.execute("""
+                DELETE FROM histograms WHERE (hour, operation) IN (
+                    SELECT hour, operation FROM histogram_stats
+                    WHERE hour < ? AND count <= sent_count
+                )
+            """, (cutoff_hour,))
+            conn.execute("""
+                DELETE FROM histogram_stats WHERE hour < ? AND count <= sent_count
+            """, (cutoff_hour,))
+        
+        with self.transaction() as conn:
+            if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+                # Switching modes rewrites the file, so it is left to this
+                # maintenance call rather than done when the database opens
+                conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+                conn.execute("VACUUM")
+            else:
+                conn.execute("PRAGMA incremental_vacuum").fetchall()
+    
+    def _database_bytes(self, conn: sqlite3.Connection) -> int:
+        """Bytes in use by the database file, excluding free pages"""
+        page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+        page_count = conn.execute("PRAGMA page_count").fetchone()[0]
+        free_pages = conn.execute("PRAGMA freelist_count").fetchone()[0]
+        return (page_count - free_pages) * page_size
+    
+    def enforce_limits(self) -> int:
+        """Evict queued events beyond max_rows/max_bytes; returns rows evicted
+
+        Rows already acknowledged by the endpoint go first, oldest first;
+        then unsent rows by event type priority, oldest first within a type.
+        The queue is trimmed to 90% of its cap so eviction does not run on
+        every insert. Rollups keep counting evicted events, and only unsent
+        ones are recorded as dropped.
+        """
+        self._inserts_since_check = 0
+        
+        with self.transaction() as conn:
+            rows = conn.execute("SELECT COUNT(*) FROM events").fetchone()[0]
+            used_bytes = self._database_bytes(conn)
+            
+            excess = 0
+            if rows > self.max_rows:
+                excess = rows - int(self.max_rows * 0.9)
+            if used_bytes > self.max_bytes and rows:
+                bytes_per_row = used_bytes / rows
+                excess = max(excess, int((used_bytes - self.max_bytes * 0.9) / bytes_per_row) + 1)
+            
+            if excess <= 0:
+                self._row_count = rows
+                return 0
+            
+            priority = " ".join(
+                f"WHEN '{event_type}' THEN {rank}"
+                for event_type, rank in self.EVICTION_PRIORITY.items()
+            )
+            ack_cursor = conn.execute("""
+                SELECT COALESCE((SELECT CAST(value AS INTEGER) FROM metadata WHERE key = 'ack_cursor'), 0)
+            """).fetchone()[0]
+            victims = conn.execute(f"""
+                SELECT id, event_type FROM events
+                ORDER BY id > ?,
+                         CASE event_type {priority} ELSE {self.DEFAULT_EVICTION_PRIORITY} END * (id > ?),
+                         id
+                LIMIT ?
+            """, (ack_cursor, ack_cursor, excess)).fetchall()
+            
+            conn.executemany("DELETE FROM events WHERE id = ?", [(row["id"],) for row in victims])
+            self._row_count = rows - len(victims)
+            
+            dropped: Dict[str, int] = {}
+            for row in victims:
+                if row["id"] > ack_cursor:
+                    dropped[row["event_type"]] = dropped.get(row["event_type"], 0) + 1
+            self._record_dropped(conn, dropped)
+        
+        with self.transaction() as conn:
+            conn.execute("PRAGMA incremental_vacuum").fetchall()
+        
+        return len(victims)
+    
+    def _record_dropped(self, conn: sqlite3.Connection, dropped: Dict[str, int]) -> None:
+        """Add to the persisted per-type dropped event counters"""
+        row = conn.execute("SELECT value FROM metadata WHERE key = 'dropped_events'").fetchone()
+        totals = json.loads(row["value"]) if row else {}
+        for event_type, count in dropped.items():
+            totals[event_type] = totals.get(event_type, 0) + count
+        conn.execute("""
+            INSERT INTO metadata (key, value) VALUES ('dropped_events', ?)
+            ON CONFLICT(key) DO UPDATE SET value = excluded.value
+        """, (json.dumps(totals),))
+    
+    def record_dropped(self, dropped: Dict[str, int]) -> None:
+        """Count events dropped before reaching the database"""
+        if dropped:
+            with self.transaction() as conn:
+                self._record_dropped(conn, dropped)
+    
+    def get_queue_stats(self) -> Dict[str, Any]:
+        """Queue size, limits and dropped event counters"""
+        with self.transaction() as conn:
+            return {
+                "rows": conn.execute("SELECT COUNT(*) FROM events").fetchone()[0],
+                "bytes": self._database_bytes(conn),
+                "max_rows": self.max_rows,
+                "max_bytes": self.max_bytes,
+                "dropped_events": self.get_metadata("dropped_events", {})
+            }
+    
+    def get_metadata(self, key: str, default: Any = None) -> Any:
+        """Read a JSON value from the metadata table"""
+        with self.transaction() as conn:
+            row = conn.execute("SELECT value FROM metadata WHERE key = ?", (key,)).fetchone()
+        return json.loads(row["value"]) if row else default
+    
+    def set_metadata(self, key: str, value: Any) -> None:
+        """Write a JSON value to the metadata table"""
+        with self.transaction() as conn:
+            conn.execute("""
+                INSERT INTO metadata (key, value) VALUES (?, ?)
+                ON CONFLICT(key) DO UPDATE SET value = excluded.value
+            """, (key, json.dumps(value)))
+    
+    def usage_summary(self, since: str) -> Dict[str, Any]:
+        """Aggregate event counts newer than an ISO-8601 UTC timestamp
+
+        Counts come from the rollups: daily buckets after the day of
+        ``since`` plus that day's hourly buckets from ``since``'s hour on.
+        Sampled categories are scaled up by their sampling rate, so their
+        counts are estimates rounded to whole events. Rows not yet copied
+        out of events_legacy are counted directly.
+        """
+        day, hour = since[:10], since[:13]
+        
+        with self.transaction() as conn:
+            rows = conn.execute("""
+                SELECT dimension, value, SUM(count) FROM rollups
+                WHERE (granularity = 'day' AND bucket > ?)
+                   OR (granularity = 'hour' AND bucket >= ? AND bucket <= ?)
+                GROUP BY dimension, value
+            """, (day, hour, day + "T23")).fetchall()
+            if self._has_legacy_events(conn):
+                rows += self._legacy_summary(conn, hour)
+        
+        totals: Dict[str, Dict[str, int]] = {}
+        for dimension, value, count in rows:
+            counts = totals.setdefault(dimension, {})
+            counts[value] = counts.get(value, 0) + round(count)
+        
+        event_types = totals.get("event_type", {})
+        return {
+            "total_events": sum(event_types.values()),
+            "font_usage": totals.get("font", {}),
+            "terminal_usage": totals.get("terminal", {}),
+            "feature_usage": totals.get("feature", {}),
+            "error_types": totals.get("error_type", {}),
+            "error_count": event_types.get("error", 0)
+        }
+    
+    def store_histograms(self, histograms: Dict[tuple, LatencyHistogram]) -> None:
+        """Merge per-(hour, operation) histograms into the stored ones
+
+        Each sample also counts as a ``performance`` event in the rollups.
+        """
+        if not histograms:
+            return
+        
+        rollup_counts: Dict[tuple, int] = {}
+        with self.transaction() as conn:
+            for (hour, operation), histogram in histograms.items():
+                conn.executemany("""
+                    INSERT INTO histograms (hour, operation, bucket, count)
+                    VALUES (?, ?, ?, ?)
+                    ON CONFLICT(hour, operation, bucket)
+                    DO UPDATE SET count = count + excluded.count
+                """, [(hour, operation, index, count) for index, count in histogram.buckets.items()])
+                
+                conn.execute("""
+                    INSERT INTO histogram_stats (hour, operation, count, total, max, failures)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                    ON CONFLICT(hour, operation) DO UPDATE SET
+                        count = count + excluded.count,
+                        total = total + excluded.total,
+                        max = MAX(max, excluded.max),
+                        failures = failures + excluded.failures
+                """, (hour, operation, histogram.count, histogram.total,
+                      histogram.max, histogram.failures))
+                
+                for key in (("hour", hour), ("day", hour[:10])):
+                    key += ("event_type", "performance")
+                    rollup_counts[key] = rollup_counts.get(key, 0) + histogram.count
+            
+            conn.executemany(self.ROLLUP_UPSERT_SQL,
+                             [(*key, count) for key, count in rollup_counts.items()])
+    
+    def get_histogram_deltas(self) -> List[Dict[str, Any]]:
+        """Histogram counts recorded since they were last acknowledged"""
+        with self.transaction() as conn:
+            return self._histogram_deltas(conn)
+    
+    def _histogram_deltas(self, conn: sqlite3.Connection) -> List[Dict[str, Any]]:
+        stats = conn.execute("""
+            SELECT hour, operation, count - sent_count AS count,
+                   total - sent_total AS total, max,
+                   failures - sent_failures AS failures
+            FROM histogram_stats
+            WHERE count > sent_count
+            ORDER BY hour, operation
+        """).fetchall()
+        
+        deltas = []
+        for row in stats:
+            buckets = conn.execute("""
+                SELECT bucket, count - sent FROM histograms
+                WHERE hour = ? AND operation = ? AND count > sent
+            """, (row["hour"], row["operation"])).fetchall()
+            deltas.append({
+                "hour": row["hour"],
+                "operation": row["operation"],
+                "base": LatencyHistogram.BASE,
+                "buckets": {str(bucket): count for bucket, count in buckets},
+                "count": row["count"],
+                "total": row["total"],
+                "max": row["max"],
+                "failures": row["failures"]
+            })
+        return deltas
+    
+    def acknowledge_histograms(self, deltas: List[Dict[str, Any]]) -> None:
+        """Record histogram deltas as shipped"""
+        with self.transaction() as conn:
+            self._acknowledge_histograms(conn, deltas)
+    
+    def _acknowledge_histograms(self, conn: sqlite3.Connection,
+                                deltas: List[Dict[str, Any]]) -> None:
+        for delta in deltas:
+            conn.executemany("""
+                UPDATE histograms SET sent = sent + ?
+                WHERE hour = ? AND operation = ? AND bucket = ?
+            """, [
+                (count, delta["hour"], delta["operation"], int(bucket))
+                for bucket, count in delta["buckets"].items()
+            ])
+            conn.execute("""
+                UPDATE histogram_stats SET
+                    sent_count = sent_count + ?,
+                    sent_total = sent_total + ?,
+                    sent_failures = sent_failures + ?
+                WHERE hour = ? AND operation = ?
+            """, (delta["count"], delta["total"], delta["failures"],
+                  delta["hour"], delta["operation"]))
+    
+    def performance_summary(self, since: str) -> Dict[str, Dict[str, Any]]:
+        """Latency percentiles per operation from the hour of ``since`` on
+
+        This is the same window usage_summary counts over.
+        """
+        hour = since[:13]
+        histograms: Dict[str, LatencyHistogram] = {}
+        
+        with self.transaction() as conn:
+            for row in conn.execute("""
+                SELECT operation, SUM(count), SUM(total), MAX(max), SUM(failures)
+                FROM histogram_stats WHERE hour >= ?
+                GROUP BY operation
+            """, (hour,)):
+                histogram = LatencyHistogram()
+                histogram.count, histogram.total, histogram.max, histogram.failures = row[1:]
+                histograms[row[0]] = histogram
+            
+            for operation, bucket, count in conn.execute("""
+                SELECT operation, bucket, SUM(count) FROM histograms
+                WHERE hour >= ?
+                GROUP BY operation, bucket
+            """, (hour,)):
+                histograms[operation].buckets[bucket] = count
+        
+        return {operation: histogram.summary() for operation, histogram in histograms.items()}
+    
+class SenderLock:
+    """Advisory lock file electing one transmitting process per machine
+
+    Uses a non-blocking ``flock`` so a process that loses the election
+    simply skips its turn. Where ``fcntl`` is unavailable every process is
+    allowed to send and the database lease alone prevents double sends.
+    """
+    
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self._file = None
+    
+    def acquire(self) -> bool:
+        """Try to become the sender; returns False if another process is"""
+        if fcntl is None:
+            return True
+        
+        lock_file = open(self.path, "a")
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return False
+        
+        self._file = lock_file
+        return True
+    
+    def release(self) -> None:
+        """Give up the sender role"""
+        if self._file is not None:
+            fcntl.flock(self._file, fcntl.LOCK_UN)
+            self._file.close()
+            self._file = None
+
+class SendBackoff:
+    """Jittered exponential backoff and circuit breaker for the sender
+
+    Each consecutive failure delays the next attempt by a random amount up
+    to ``base_delay * 2**(failures - 1)`` (capped at ``max_delay``). After
+    ``failure_threshold`` consecutive failures the circuit opens and no
+    attempts are made for ``cooldown`` seconds. State is persisted in the
+    database so a restarted process respects it too.
+    """
+    
+    STATE_KEY = "sender_backoff"
+    
+    def __init__(self, database: LocalDatabase, base_delay: float = 1.0,
+                 max_delay: float = 300.0, failure_threshold: int = 5,
+                 cooldown: float = 600.0):
+        self.database = database
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+    
+    def _load(self) -> Dict[str, float]:
+        return self.database.get_metadata(self.STATE_KEY, {"failures": 0, "next_attempt": 0})
+    
+    def allow(self) -> bool:
+        """Whether a transmission may be attempted now"""
+        return time.time() >= self._load()["next_attempt"]
+    
+    def is_open(self) -> bool:
+        """Whether the circuit breaker is currently open"""
+        state = self._load()
+        return state["failures"] >= self.failure_threshold and time.time() < state["next_attempt"]
+    
+    def record_success(self) -> None:
+        """Reset backoff after a successful transmission"""
+        if self._load()["failures"]:
+            self.database.set_metadata(self.STATE_KEY, {"failures": 0, "next_attempt": 0})
+    
+    def record_failure(self) -> None:
+        """Schedule the next attempt after a failed transmission"""
+        failures = self._load()["failures"] + 1
+        
+        if failures >= self.failure_threshold:
+            delay = self.cooldown
+            if failures == self.failure_threshold:
+                print(f"Telemetry endpoint unavailable, pausing transmission for {int(delay)}s")
+        else:
+            delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (failures - 1)))
+        
+        self.database.set_metadata(self.STATE_KEY, {
+            "failures": failures,
+            "next_attempt": time.time() + delay
+        })
+
+class TelemetryTransport:
+    """Ships stored events to the analytics endpoint over a pooled session
+
+    ``protocol="json"`` posts the original one-object-per-event payload.
+    ``protocol="batch"`` groups events by their per-session constant fields
+    (session, user, platform, terminal, version), sends those once per group
+    as a header, and compresses the body. The server may lower the batch
+    size via the ``X-Telemetry-Max-Batch`` response header or reject an
+    oversized batch with 413.
+    """
+    
+    MAX_BATCH_HEADER = "X-Telemetry-Max-Batch"
+    
+    def __init__(self, endpoint: str, version: str, protocol: str = "json",
+                 compression: Optional[str] = None, timeout: float = 10,
+                 max_batch_size: int = 1000):
+        if protocol not in ("json", "batch"):
+            raise ValueError(f"Unknown telemetry protocol: {protocol}")
+        if compression not in (None, "gzip", "zstd"):
+            raise ValueError(f"Unknown telemetry compression: {compression}")
+        if compression == "zstd" and zstandard is None:
+            compression = "gzip"
+        
+        self.endpoint = endpoint
+        self.version = version
+        self.protocol = protocol
+        self.compression = compression
+        self.timeout = timeout
+        self.max_batch_size = max_batch_size
+        self._session: Optional[requests.Session] = None
+    
+    @property
+    def session(self) -> requests.Session:
+        """Keep-alive session shared by every transmission"""
+        if self._session is None:
+            self._session = requests.Session()
+            self._session.headers.update({
+                "User-Agent": f"CursiveTerminal/{self.version}",
+                self.MAX_BATCH_HEADER: str(self.max_batch_size)
+            })
+        return self._session
+    
+    def close(self) -> None:
+        """Close pooled connections"""
+        if self._session is not None:
+            self._session.close()
+            self._session = None
+    
+    def build_payload(self, events: List[Dict],
+                      histograms: List[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """Convert stored event rows and histogram deltas into the transmission format"""
+        meta = {
+            "client_version": self.version,
+            "transmission_time": datetime.now(timezone.utc).isoformat()
+        }
+        
+        if self.protocol == "json":
+            payload = {
+                "events": [
+                    {
+                        "type": event["event_type"],
+                        "timestamp": event["timestamp"],
+                        "session_id": event["session_id"],
+                        "user_id": event["user_id_hash"],
+                        "platform": event["platform"],
+                        "terminal": event["terminal"],
+                        "font": event["font"],
+                        "properties": event["properties"],
+                        "version": event["version"]
+                    }
+                    for event in events
+                ],
+                "meta": meta
+            }
+            if histograms:
+                payload["histograms"] = histograms
+            return payload
+        
+        groups: Dict[tuple, Dict[str, Any]] = {}
+        for event in events:
+            key = (event["session_id"], event["user_id_hash"], event["platform"],
+                   event["terminal"], event["version"])
+            if key not in groups:
+                groups[key] = {
+                    "header": {
+                        "session_id": event["session_id"],
+                        "user_id": event["user_id_hash"],
+                        "platform": event["platform"],
+                        "terminal": event["terminal"],
+                        "version": event["version"]
+                    },
+                    "events": []
+                }
+            groups[key]["events"].append({
+                "type": event["event_type"],
+                "timestamp": event["timestamp"],
+                "font": event["font"],
+                "properties": event["properties"]
+            })
+        
+        meta["protocol"] = 2
+        payload = {"batches": list(groups.values()), "meta": meta}
+        if histograms:
+            payload["histograms"] = histograms
+        return payload
+    
+    def encode(self, payload: Dict[str, Any]) -> tuple:
+        """Serialize and compress a payload, returning (body, headers)"""
+        body = json.dumps(payload, separators=(",", ":")).encode()
+        headers = {"Content-Type": "application/json"}
+        
+        if self.compression == "gzip":
+            body = gzip.compress(body, compresslevel=6)
+            headers["Content-Encoding"] = "gzip"
+        elif self.compression == "zstd":
+            body = zstandard.ZstdCompressor().compress(body)
+            headers["Content-Encoding"] = "zstd"
+        
+        return body, headers
+    
+    def send(self, events: List[Dict], histograms: List[Dict[str, Any]] = None) -> bool:
+        """Transmit one batch; returns True if the server accepted it"""
+        body, headers = self.encode(self.build_payload(events, histograms))
+        response = self.session.post(self.endpoint, data=body,
+                                     timeout=self.timeout, headers=headers)
+        return self.handle_response(response.status_code, response.headers, len(events))
+    
+    def handle_response(self, status: int, headers: Dict[str, str], batch_size: int) -> bool:
+        """Apply the server's batch size hints; returns True if accepted"""
+        server_max = headers.get(self.MAX_BATCH_HEADER)
+        if server_max and server_max.isdigit():
+            self.max_batch_size = max(1, min(self.max_batch_size, int(server_max)))
+        
+        if status == 413 and batch_size > 1:
+            # Payload too large: halve the batch size for the next attempt
+            self.max_batch_size = max(1, min(self.max_batch_size, batch_size // 2))
+        
+        return status == 200
+
+class TelemetryWriter:
+    """Buffers events in memory and persists/transmits them in the background
+
+    Callers only append to a bounded ring buffer. A writer thread drains it
+    into ``executemany`` transactions and a sender thread ships batches once
+    enough events are stored or the send interval elapses. When a burst
+    fills the buffer the oldest event is dropped and counted; callers that
+    can afford to wait on disk may opt in to waiting up to ``max_block``
+    seconds for the writer to make room first.
+    """
+    
+    def __init__(self, database: LocalDatabase, send: Callable[[int], bool],
+                 buffer_size: int = 50000, write_batch_size: int = 2000,
+                 write_interval: float = 0.5, send_batch_size: int = 100,
+                 send_interval: float = 30.0, max_block: float = 0):
+        self.database = database
+        self.send = send
+        self.buffer_size = buffer_size
+        self.write_batch_size = write_batch_size
+        self.write_interval = write_interval
+        self.send_batch_size = send_batch_size
+        self.send_interval = send_interval
+        self.max_block = max_block
+        
+        self._pid: Optional[int] = None
+        self._stopping = threading.Event()
+        self._init_state()
+        
+        # Called with force=False from the writer thread and force=True on
+        # flush, so producers holding events back can release them
+        self.flush_hooks: List[Callable[[bool], None]] = []
+        
+        atexit.register(self.close)
+    
+    def _init_state(self) -> None:
+        """Create the buffer, locks and thread list"""
+        lock = threading.Lock()
+        # Oldest events are overwritten when the buffer is full
+        self._buffer: deque = deque(maxlen=self.buffer_size)
+        self._buffer_cond = threading.Condition(lock)
+        self._space_cond = threading.Condition(lock)
+        self._write_lock = threading.Lock()
+        self._send_lock = threading.Lock()
+        self._send_wakeup = threading.Event()
+        self._threads: List[threading.Thread] = []
+        self._unsent = 0
+        self._dropped: Dict[str, int] = {}
+    
+    def start(self) -> None:
+        """Start the background threads on first use, and again after a fork"""
+        if self._threads and self._pid == os.getpid():
+            return
+        
+        if self._pid is not None and self._pid != os.getpid():
+            # The parent's threads did not survive the fork and its locks may
+            # be held; buffered events are the parent's to write
+            self._init_state()
+        
+        with self._buffer_cond:
+            if self._threads or self._stopping.is_set():
+                return
+            
+            self._pid = os.getpid()
+            self._threads = [
+                threading.Thread(target=self._write_loop, name="telemetry-writer", daemon=True),
+                threading.Thread(target=self._send_loop, name="telemetry-sender", daemon=True)
+            ]
+            for thread in self._threads:
+                thread.start()
+    
+    def enqueue(self, event: TelemetryEvent) -> None:
+        """Queue an event without touching disk or network"""
+        self.start()
+        
+        with self._buffer_cond:
+            if (len(self._buffer) == self._buffer.maxlen and self.max_block > 0
+                    and not self._stopping.is_set()
+                    and threading.current_thread() not in self._threads):
+                self._buffer_cond.notify()
+                self._space_cond.wait_for(lambda: len(self._buffer) < self._buffer.maxlen,
+                                          self.max_block)
+            
+            if len(self._buffer) == self._buffer.maxlen:
+                overwritten = self._buffer[0].event_type
+                self._dropped[overwritten] = self._dropped.get(overwritten, 0) + 1
+            self._buffer.append(event)
+            if len(self._buffer) >= self.write_batch_size:
+                self._buffer_cond.notify()
+    
+    def _drain(self) -> List[TelemetryEvent]:
+        """Take up to one write batch from the buffer"""
+        with self._buffer_cond:
+            count = min(len(self._buffer), self.write_batch_size)
+            batch = [self._buffer.popleft() for _ in range(count)]
+            if batch:
+                self._space_cond.notify_all()
+            return batch
+    
+    def _requeue(self, batch: List[TelemetryEvent]) -> None:
+        """Return a batch that could not be stored to the front of the buffer"""
+        with self._buffer_cond:
+            # Newer events arrived meanwhile, so the oldest of the batch give
+            # way if there is not room for all of it
+            overflow = max(0, len(batch) - (self._buffer.maxlen - len(self._buffer)))
+            for event in batch[:overflow]:
+                self._dropped[event.event_type] = self._dropped.get(event.event_type, 0) + 1
+            self._buffer.extendleft(reversed(batch[overflow:]))
+    
+    def _write_pending(self) -> None:
+        """Persist everything currently buffered"""
+        with self._write_lock:
+            with self._buffer_cond:
+                dropped, self._dropped = self._dropped, {}
+            if dropped:
+                try:
+                    self.database.record_dropped(dropped)
+                except Exception as e:
+                    print(f"Error storing telemetry events: {e}")
+            
+            while True:
+                batch = self._drain()
+                if not batch:
+                    return
+                
+                try:
+                    self.database.store_events(batch)
+                except Exception as e:
+                    # Retried on the next pass, e.g. once a lock is released
+                    print(f"Error storing telemetry events: {e}")
+                    self._requeue(batch)
+                    return
+                
+                self._unsent += len(batch)
+                if self._unsent >= self.send_batch_size:
+                    self._send_wakeup.set()
+    
+    def _send_pending(self) -> None:
+        """Ship one batch of stored events"""
+        with self._send_lock:
+            self._unsent = 0
             try:
-                with open(self.privacy_file) as f:
-                    return {**default_settings, **json.load(f)}
-            except Exception:
-                pass
-        
-        return default_settings
+                self.send(self.send_batch_size)
+            except Exception as e:
+                print(f"Error transmitting telemetry events: {e}")
     
-    def update_privacy_settings(self, settings: Dict[str, bool]) -> None:
-        """Update user privacy preferences"""
-        current = self.get_privacy_settings()
-        current.update(settings)
-        
-        with open(self.privacy_file, 'w') as f:
-            json.dump(current, f, indent=2)
+    def _write_loop(self) -> None:
+        while not self._stopping.is_set():
+            with self._buffer_cond:
+                if len(self._buffer) < self.write_batch_size:
+                    self._buffer_cond.wait(self.write_interval)
+            self._run_flush_hooks(force=False)
+            self._write_pending()
     
-    def get_anonymous_user_id(self) -> str:
-        """Get or create anonymous user ID"""
-        if self.user_id_file.exists():
-            try:
-                with open(self.user_id_file) as f:
-                    return f.read().strip()
-            except Exception:
-                pass
-        
-        # Create new anonymous ID
-        user_id = str(uuid.uuid4())
-        try:
-            with open(self.user_id_file, 'w') as f:
-                f.write(user_id)
-        except Exception:
-            pass
-        
-        return user_id
+    def _send_loop(self) -> None:
+        while not self._stopping.is_set():
+            self._send_wakeup.wait(self.send_interval)
+            self._send_wakeup.clear()
+            if not self._stopping.is_set():
+                self._send_pending()
     
-    def hash_identifier(self, identifier: str) -> str:
-        """Create a privacy-safe hash of an identifier"""
-        return hashlib.sha256(identifier.encode()).hexdigest()[:16]
-
-class SystemDetector:
-    """Detects system information for telemetry"""
+    def _run_flush_hooks(self, force: bool) -> None:
+        for hook in self.flush_hooks:
+            try:
+                hook(force)
+            except Exception as e:
+                print(f"Error flushing telemetry events: {e}")
     
-    @staticmethod
-    def get_platform_info() -> Dict[str, str]:
-        """Get basic platform information"""
-        return {
-            "os": platform.system(),
-            "os_version": platform.release(),
-            "arch": platform.machine(),
-            "python_version": platform.python_version()
-        }
+    def flush(self, transmit: bool = True) -> None:
+        """Persist all buffered events and optionally transmit them now"""
+        self._run_flush_hooks(force=True)
+        self._write_pending()
+        if transmit:
+            self._send_pending()
     
-    @staticmethod
-    def detect_terminal() -> Optional[str]:
-        """Detect which terminal is being used"""
-        terminal_vars = [
-            ("TERM_PROGRAM", {
-                "iTerm.app": "iTerm2",
-                "Apple_Terminal": "Terminal.app",
-                "vscode": "VS Code Terminal",
-                "Hyper": "Hyper"
-            }),
-            ("TERMINAL_EMULATOR", {
-                "JetBrains-JediTerm": "JetBrains Terminal"
-            })
-        ]
+    def close(self, transmit: bool = True) -> None:
+        """Stop the background threads and drain the buffer"""
+        if self._stopping.is_set():
+            return
         
-        for var, mapping in terminal_vars:
-            value = os.environ.get(var)
-            if value in mapping:
-                return mapping[value]
+        self._stopping.set()
+        with self._buffer_cond:
+            self._buffer_cond.notify_all()
+        self._send_wakeup.set()
         
-        # Check for specific terminal processes
-        try:
-            result = subprocess.run(['ps', 'aux'], capture_output=True, text=True)
-            processes = result.stdout.lower()
-            
-            if 'alacritty' in processes:
-                return "Alacritty"
-            elif 'warp' in processes:
-                return "Warp"
-            elif 'kitty' in processes:
-                return "Kitty"
-        except Exception:
-            pass
+        for thread in self._threads:
+            thread.join(timeout=self.write_interval + 1)
         
-        return os.environ.get("TERM", "Unknown")
+        self.flush(transmit=transmit)
+        atexit.unregister(self.close)
+
+class TokenBucket:
+    """Token bucket allowing ``rate`` events per second with bursts of ``burst``"""
     
-    @staticmethod
-    def get_font_info() -> Dict[str, Any]:
-        """Get information about installed fonts"""
-        font_info = {
-            "victor_mono": False,
-            "cascadia_code": False,
-            "jetbrains_mono": False,
-            "fira_code": False,
-            "total_fonts": 0
-        }
-        
-        font_dir = Path.home() / "Library" / "Fonts"
-        if font_dir.exists():
-            fonts = list(font_dir.glob("*.otf")) + list(font_dir.glob("*.ttf"))
-            font_info["total_fonts"] = len(fonts)
-            
-            font_names = [f.name.lower() for f in fonts]
-            font_info["victor_mono"] = any("victormono" in name for name in font_names)
-            font_info["cascadia_code"] = any("cascadia" in name for name in font_names)
-            font_info["jetbrains_mono"] = any("jetbrains" in name for name in font_names)
-            font_info["fira_code"] = any("fira" in name for name in font_names)
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+    
+    def take(self) -> bool:
+        """Consume one token if available"""
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
         
-        return font_info
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
 
-class LocalDatabase:
-    """Local SQLite database for storing telemetry before transmission"""
+class TelemetrySampler:
+    """Applies per-category sampling and token-bucket rate limits
+
+    Settings come from ``PrivacyManager.get_limit_settings`` and are
+    re-read as that snapshot changes. Rejected events are counted per
+    category in ``stats``.
+    """
     
-    def __init__(self, db_path: str = "~/.config/cursive-terminal/telemetry.db"):
-        self.db_path = Path(db_path).expanduser()
-        self.db_path.parent.mkdir(parents=True, exist_ok=True)
-        self.init_database()
+    def __init__(self, privacy: PrivacyManager):
+        self.privacy = privacy
+        self._buckets: Dict[str, tuple] = {}
+        self._lock = threading.Lock()
+        self.stats: Dict[str, Dict[str, int]] = {"sampled_out": {}, "rate_limited": {}}
     
-    def init_database(self) -> None:
-        """Initialize the local database"""
-        with sqlite3.connect(self.db_path) as conn:
-            conn.execute("""
-                CREATE TABLE IF NOT EXISTS events (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    event_type TEXT NOT NULL,
-                    timestamp TEXT NOT NULL,
-                    session_id TEXT NOT NULL,
-                    user_id_hash TEXT NOT NULL,
-                    platform TEXT NOT NULL,
-                    terminal TEXT,
-                    font TEXT,
-                    properties TEXT,
-                    version TEXT NOT NULL,
-                    transmitted BOOLEAN DEFAULT FALSE,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            """)
+    def _count(self, reason: str, category: str) -> None:
+        self.stats[reason][category] = self.stats[reason].get(category, 0) + 1
+    
+    def sample_rate(self, category: str) -> float:
+        """Fraction of events kept for a category"""
+        return float(self.privacy.get_limit_settings()["sampling"].get(category, 1.0))
+    
+    def aggregate_window(self, category: str) -> float:
+        """Pre-aggregation window for a category, 0 if disabled"""
+        return float(self.privacy.get_limit_settings()["aggregate"].get(category, 0))
+    
+    def admit(self, category: str, rate_limit: bool = True) -> bool:
+        """Decide whether an event in this category should be recorded"""
+        rate = self.sample_rate(category)
+        limit = self.privacy.get_limit_settings()["rate_limits"].get(category)
+        
+        with self._lock:
+            if rate < 1.0 and random.random() >= rate:
+                self._count("sampled_out", category)
+                return False
             
-            conn.execute("""
-                CREATE INDEX IF NOT EXISTS idx_timestamp ON events(timestamp)
-            """)
+            if not limit or not rate_limit:
+                return True
             
-            conn.execute("""
-                CREATE INDEX IF NOT EXISTS idx_transmitted ON events(transmitted)
-            """)
+            # Rebuild the bucket if its settings changed
+            settings = (limit["rate"], limit["burst"])
+            entry = self._buckets.get(category)
+            if entry is None or entry[0] != settings:
+                entry = (settings, TokenBucket(*settings))
+                self._buckets[category] = entry
+            
+            if not entry[1].take():
+                self._count("rate_limited", category)
+                return False
+            return True
+
+class EventAggregator:
+    """Merges identical events over a window into one weighted event
+
+    Events are identical when their type, font and properties match. The
+    merged event carries an ``aggregate`` property with the count.
+    """
     
-    def store_event(self, event: TelemetryEvent) -> None:
-        """Store an event in the local database"""
-        with sqlite3.connect(self.db_path) as conn:
-            conn.execute("""
-                INSERT INTO events (
-                    event_type, timestamp, session_id, user_id_hash,
-                    platform, terminal, font, properties, version
-                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-            """, (
-                event.event_type,
-                event.timestamp,
-                event.session_id,
-                event.user_id_hash,
-                event.platform,
-                event.terminal,
-                event.font,
-                json.dumps(event.properties),
-                event.version
+    def __init__(self, emit: Callable[[TelemetryEvent], None]):
+        self.emit = emit
+        self._groups: Dict[tuple, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+    
+    def add(self, event: TelemetryEvent, window: float) -> None:
+        """Fold an event into its group"""
+        key = (event.event_type, event.font,
+               json.dumps(event.properties, sort_keys=True, default=str))
+        
+        with self._lock:
+            group = self._groups.get(key)
+            if group is None:
+                group = {
+                    "event": event,
+                    "deadline": time.monotonic() + window,
+                    "count": 0
+                }
+                self._groups[key] = group
+            group["count"] += 1
+    
+    def drain(self, force: bool = False) -> None:
+        """Emit groups whose window has elapsed (all groups if force)"""
+        now = time.monotonic()
+        with self._lock:
+            ready = [key for key, group in self._groups.items()
+                     if force or group["deadline"] <= now]
+            groups = [self._groups.pop(key) for key in ready]
+        
+        for group in groups:
+            first = group["event"]
+            self.emit(TelemetryEvent(
+                event_type=first.event_type,
+                timestamp=first.timestamp,
+                session_id=first.session_id,
+                user_id_hash=first.user_id_hash,
+                platform=first.platform,
+                terminal=first.terminal,
+                font=first.font,
+                properties={**first.properties, "aggregate": {"count": group["count"]}},
+                version=first.version
             ))
+
+class TimedOperation:
+    """Times a block or function and records it via track_performance
+
+    Usable as a context manager (``with``/``async with``) or as a decorator
+    on plain and async functions. Spans opened inside another span are
+    recorded as ``parent/child``, and an exception marks the sample as a
+    failure. Without a collector the shared default collector is used.
+    Telemetry errors are reported and never reach the timed code.
+    """
     
-    def get_untransmitted_events(self, limit: int = 100) -> List[Dict]:
-        """Get events that haven't been transmitted yet"""
-        with sqlite3.connect(self.db_path) as conn:
-            conn.row_factory = sqlite3.Row
-            cursor = conn.execute("""
-                SELECT * FROM events 
-                WHERE transmitted = FALSE 
-                ORDER BY created_at ASC 
-                LIMIT ?
-            """, (limit,))
-            return [dict(row) for row in cursor.fetchall()]
+    def __init__(self, operation: str, collector: "TelemetryCollector" = None):
+        self.operation = operation
+        self.collector = collector
+        self.name: Optional[str] = None
+        self._recorder: Optional["TelemetryCollector"] = None
+        self._start: Optional[int] = None
+        self._token = None
     
-    def mark_transmitted(self, event_ids: List[int]) -> None:
-        """Mark events as transmitted"""
-        if not event_ids:
-            return
-            
-        with sqlite3.connect(self.db_path) as conn:
-            placeholders = ','.join('?' * len(event_ids))
-            conn.execute(f"""
-                UPDATE events 
-                SET transmitted = TRUE 
-                WHERE id IN ({placeholders})
-            """, event_ids)
+    def _resolve(self) -> Optional["TelemetryCollector"]:
+        """Collector to record into, or None when performance metrics are off"""
+        collector = self.collector
+        if collector is None:
+            # Disabled metrics cost one settings lookup, without opening
+            # the database behind the default collector
+            if _default_collector is None and not default_privacy().is_enabled("performance_metrics"):
+                return None
+            collector = default_collector()
+        
+        return collector if collector.is_enabled("performance_metrics") else None
     
-    def cleanup_old_events(self, days_old: int = 30) -> None:
-        """Remove old transmitted events"""
-        with sqlite3.connect(self.db_path) as conn:
-            conn.execute("""
-                DELETE FROM events 
-                WHERE transmitted = TRUE 
-                AND datetime(created_at) < datetime('now', '-{} days')
-            """.format(days_old))
+    def __enter__(self) -> "TimedOperation":
+        try:
+            self._recorder = self._resolve()
+        except Exception as e:
+            print(f"Error starting timed operation: {e}")
+            self._recorder = None
+        
+        if self._recorder is None:
+            return self
+        
+        parent = _current_span.get()
+        self.name = f"{parent}/{self.operation}" if parent else self.operation
+        self._token = _current_span.set(self.name)
+        self._start = time.perf_counter_ns()
+        return self
+    
+    def __exit__(self, exc_type, exc, traceback) -> bool:
+        if self._start is None:
+            return False
+        
+        duration_ms = (time.perf_counter_ns() - self._start) / 1_000_000
+        self._start = None
+        _current_span.reset(self._token)
+        try:
+            self._recorder.track_performance(self.name, duration_ms, success=exc_type is None)
+        except Exception as e:
+            print(f"Error recording timed operation: {e}")
+        return False
+    
+    async def __aenter__(self) -> "TimedOperation":
+        return self.__enter__()
+    
+    async def __aexit__(self, exc_type, exc, traceback) -> bool:
+        return self.__exit__(exc_type, exc, traceback)
+    
+    def __call__(self, func: Callable) -> Callable:
+        """Wrap a function so that every call is timed"""
+        if inspect.iscoroutinefunction(func):
+            @wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                async with TimedOperation(self.operation, self.collector):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+        
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with TimedOperation(self.operation, self.collector):
+                return func(*args, **kwargs)
+        return wrapper
 
 class TelemetryCollector:
     """Main telemetry collection and transmission system"""
     
-    def __init__(self, version: str = "1.0.0", endpoint: str = None):
+    def __init__(self, version: str = "1.0.0", endpoint: str = None,
+                 protocol: str = "json", compression: Optional[str] = None,
+                 config_dir: str = "~/.config/cursive-terminal"):
         self.version = version
         self.endpoint = endpoint or "https://analytics.cursiveterminal.com/collect"
         self.session_id = str(uuid.uuid4())
         
-        self.privacy = PrivacyManager()
-        self.detector = SystemDetector()
-        self.database = LocalDatabase()
+        config_path = Path(config_dir).expanduser()
+        self.privacy = PrivacyManager(config_dir)
+        self.detector = SystemDetector(cache_file=str(config_path / "system_cache.json"))
+        self.database = LocalDatabase(str(config_path / "telemetry.db"))
+        self.transport = TelemetryTransport(self.endpoint, self.version,
+                                            protocol=protocol, compression=compression)
+        self.backoff = SendBackoff(self.database)
+        self._transmit_lock = threading.Lock()
+        self.sender_lock = SenderLock(self.database.db_path.with_name("telemetry.send.lock"))
+        self.writer = TelemetryWriter(self.database, self.transmit_events)
+        self.sampler = TelemetrySampler(self.privacy)
+        self.aggregator = EventAggregator(self.writer.enqueue)
+        self.writer.flush_hooks.append(self.aggregator.drain)
+        
+        # Latency samples accumulate per (hour, operation) until the writer
+        # thread persists them
+        self._histograms: Dict[tuple, LatencyHistogram] = {}
+        self._histogram_lock = threading.Lock()
+        self.writer.flush_hooks.append(self._write_histograms)
         
-        # Get system info once per session
-        self.platform_info = self.detector.get_platform_info()
-        self.terminal = self.detector.detect_terminal()
-        self.font_info = self.detector.get_font_info()
+        # Schema backfills left by a migration advance one chunk per
+        # writer pass, so a large upgrade never stalls event recording
+        self.writer.flush_hooks.append(self._run_backfills)
         
+        # The anonymous id never changes within a session
+        self.user_id_hash = self.privacy.hash_identifier(self.privacy.get_anonymous_user_id())
+    
+    @cached_property
+    def platform_info(self) -> Dict[str, str]:
+        """Platform information, detected on first use"""
+        return self.detector.get_platform_info()
+    
+    @cached_property
+    def platform_name(self) -> str:
+        """Platform label stored on every event"""
+        return f"{self.platform_info['os']} {self.platform_info['os_version']}"
+    
+    @cached_property
+    def terminal(self) -> Optional[str]:
+        """Terminal in use, detected on first use"""
+        return self.detector.cached_terminal()
+    
+    @cached_property
+    def font_info(self) -> Dict[str, Any]:
+        """Installed font summary, detected on first use"""
+        return self.detector.cached_font_info()
+    
     def is_enabled(self, category: str = "analytics_enabled") -> bool:
         """Check if a specific category of telemetry is enabled"""
-        settings = self.privacy.get_privacy_settings()
-        return settings.get(category, False)
+        return self.privacy.is_enabled(category)
     
     def create_event(self, event_type: str, properties: Dict[str, Any] = None, 
                     font: str = None) -> TelemetryEvent:
@@ -284,8 +2405,8 @@ class TelemetryCollector:
             event_type=event_type,
             timestamp=datetime.now(timezone.utc).isoformat(),
             session_id=self.session_id,
-            user_id_hash=self.privacy.hash_identifier(self.privacy.get_anonymous_user_id()),
-            platform=f"{self.platform_info['os']} {self.platform_info['os_version']}",
+            user_id_hash=self.user_id_hash,
+            platform=self.platform_name,
             terminal=self.terminal,
             font=font,
             properties=properties or {},
@@ -298,23 +2419,62 @@ class TelemetryCollector:
         if not self.is_enabled(category):
             return
         
+        self._record(event_type, properties, font, category)
+    
+    def _record(self, event_type: str, properties: Dict[str, Any] = None,
+                font: str = None, category: str = "analytics_enabled") -> None:
+        """Queue an event whose category has already been checked"""
         try:
+            # Aggregated categories are already bounded, so skip the rate limit
+            window = self.sampler.aggregate_window(category)
+            if not self.sampler.admit(category, rate_limit=window <= 0):
+                return
+            
             event = self.create_event(event_type, properties, font)
-            self.database.store_event(event)
             
-            # Try to transmit immediately (non-blocking)
-            self.transmit_events(max_events=1)
+            sample_rate = self.sampler.sample_rate(category)
+            if sample_rate < 1.0:
+                event.properties = {**event.properties, "sample_rate": sample_rate}
+            
+            if window > 0:
+                self.aggregator.add(event, window)
+            else:
+                # Persisted and transmitted by the background writer
+                self.writer.enqueue(event)
             
         except Exception as e:
             print(f"Error tracking event: {e}")
     
+    def _run_backfills(self, force: bool = False) -> None:
+        self.database.run_backfills(max_chunks=1)
+    
+    def timed(self, operation: str) -> TimedOperation:
+        """Time a block or function as ``operation``"""
+        return TimedOperation(operation, self)
+    
+    def _write_histograms(self, force: bool = False) -> None:
+        """Persist the latency samples recorded since the last write"""
+        with self._histogram_lock:
+            histograms, self._histograms = self._histograms, {}
+        self.database.store_histograms(histograms)
+    
+    def flush(self, transmit: bool = True) -> None:
+        """Write buffered events to disk and optionally transmit them"""
+        self.writer.flush(transmit=transmit)
+    
+    def close(self) -> None:
+        """Drain buffered events and release the database connection"""
+        self.writer.close()
+        self.transport.close()
+        self.database.close()
+    
     def track_installation(self, font_name: str, success: bool, 
                           install_method: str = "script") -> None:
         """Track font installation events"""
         if not self.is_enabled("font_popularity"):
             return
             
-        self.track_event("font_installation", {
+        self._record("font_installation", {
             "success": success,
             "install_method": install_method,
             "existing_fonts": self.font_info["total_fonts"]
@@ -326,7 +2486,7 @@ class TelemetryCollector:
         if not self.is_enabled("usage_statistics"):
             return
             
-        self.track_event("terminal_configuration", {
+        self._record("terminal_configuration", {
             "theme": theme,
             "automated": automated,
             "terminal_version": os.environ.get("TERM_PROGRAM_VERSION")
@@ -341,23 +2501,30 @@ class TelemetryCollector:
         # Hash error message to protect privacy
         error_hash = self.privacy.hash_identifier(error_message)
         
-        self.track_event("error", {
+        self._record("error", {
             "error_type": error_type,
             "error_hash": error_hash,
             "context": context or {}
         }, category="error_reporting")
     
-    def track_performance(self, operation: str, duration_ms: int,
+    def track_performance(self, operation: str, duration_ms: float,
                          success: bool = True) -> None:
-        """Track performance metrics"""
+        """Track performance metrics
+
+        Durations go into a per-operation latency histogram rather than
+        individual events, so every sample is kept at constant cost.
+        """
         if not self.is_enabled("performance_metrics"):
             return
-            
-        self.track_event("performance", {
-            "operation": operation,
-            "duration_ms": duration_ms,
-            "success": success
-        }, category="performance_metrics")
+        
+        hour = datetime.now(timezone.utc).isoformat()[:13]
+        with self._histogram_lock:
+            histogram = self._histograms.get((hour, operation))
+            if histogram is None:
+                histogram = self._histograms[(hour, operation)] = LatencyHistogram()
+            histogram.record(duration_ms, success)
+        
+        self.writer.start()
     
     def track_feature_usage(self, feature: str, action: str = "used",
                            properties: Dict[str, Any] = None) -> None:
@@ -365,7 +2532,7 @@ class TelemetryCollector:
         if not self.is_enabled("feature_usage"):
             return
             
-        self.track_event("feature_usage", {
+        self._record("feature_usage", {
             "feature": feature,
             "action": action,
             **(properties or {})
@@ -376,101 +2543,347 @@ class TelemetryCollector:
         if not self.is_enabled("analytics_enabled"):
             return False
         
-        try:
-            events = self.database.get_untransmitted_events(max_events)
-            if not events:
-                return True
-            
-            # Convert to transmission format
-            payload = {
-                "events": [
-                    {
-                        "type": event["event_type"],
-                        "timestamp": event["timestamp"],
-                        "session_id": event["session_id"],
-                        "user_id": event["user_id_hash"],
-                        "platform": event["platform"],
-                        "terminal": event["terminal"],
-                        "font": event["font"],
-                        "properties": json.loads(event["properties"]),
-                        "version": event["version"]
-                    }
-                    for event in events
-                ],
-                "meta": {
-                    "client_version": self.version,
-                    "transmission_time": datetime.now(timezone.utc).isoformat()
-                }
-            }
-            
-            # Transmit with timeout
-            response = requests.post(
-                self.endpoint,
-                json=payload,
-                timeout=10,
-                headers={
-                    "Content-Type": "application/json",
-                    "User-Agent": f"CursiveTerminal/{self.version}"
-                }
-            )
-            
-            if response.status_code == 200:
-                # Mark events as transmitted
-                event_ids = [event["id"] for event in events]
-                self.database.mark_transmitted(event_ids)
-                return True
-            else:
-                print(f"Failed to transmit events: {response.status_code}")
+        # One transmission at a time: the thread lock covers this process,
+        # the lock file other processes sharing the database
+        with self._transmit_lock:
+            if not self.backoff.allow() or not self.sender_lock.acquire():
                 return False
-                
+            
+            try:
+                return self._transmit_batch(max_events)
+            finally:
+                self.sender_lock.release()
+    
+    def _transmit_batch(self, max_events: int) -> bool:
+        """Lease, send and acknowledge one batch"""
+        batch = self._claim_batch(max_events)
+        if batch is None:
+            return False
+        if not batch["events"] and not batch["histograms"]:
+            return True
+        
+        try:
+            sent = self.transport.send(batch["events"], batch["histograms"])
+        except Exception:
+            sent = False
+        
+        return self._complete_batch(batch, sent)
+    
+    def _claim_batch(self, max_events: int) -> Optional[Dict[str, Any]]:
+        """Lease the next batch, or None if it cannot be claimed now"""
+        try:
+            batch_size = min(max_events, self.transport.max_batch_size)
+            # Outlive a full request timeout so a slow send keeps its lease
+            return self.database.claim_batch(batch_size, lease_seconds=self.transport.timeout * 6)
         except Exception as e:
             print(f"Error transmitting events: {e}")
+            return None
+    
+    def _complete_batch(self, batch: Dict[str, Any], sent: bool) -> bool:
+        """Acknowledge or release a leased batch and update the backoff"""
+        # Advance the acknowledgement cursor past this batch
+        self.database.complete_batch(batch, sent)
+        
+        if not sent:
+            self.backoff.record_failure()
             return False
+        
+        self.backoff.record_success()
+        return True
     
     def generate_usage_report(self, days: int = 30) -> Dict[str, Any]:
         """Generate a local usage report"""
-        with sqlite3.connect(self.database.db_path) as conn:
-            conn.row_factory = sqlite3.Row
-            
-            # Get events from last N days
-            cursor = conn.execute("""
-                SELECT event_type, font, properties, timestamp
-                FROM events 
-                WHERE datetime(timestamp) > datetime('now', '-{} days')
-                ORDER BY timestamp DESC
-            """.format(days))
-            
-            events = [dict(row) for row in cursor.fetchall()]
-        
-        # Analyze events
-        report = {
-            "total_events": len(events),
+        since = (datetime.now(timezone.utc) - timedelta(days=days)).isoformat()
+        summary = self.database.usage_summary(since)
+        
+        return {
+            "total_events": summary["total_events"],
             "date_range": f"Last {days} days",
-            "font_usage": {},
-            "terminal_usage": {},
-            "feature_usage": {},
-            "error_count": 0
+            "font_usage": summary["font_usage"],
+            "terminal_usage": summary["terminal_usage"],
+            "feature_usage": summary["feature_usage"],
+            "error_count": summary["error_count"],
+            "error_types": summary["error_types"],
+            "performance": self.database.performance_summary(since)
+        }
+
+class AsyncTelemetryCollector:
+    """asyncio front end for TelemetryCollector
+
+    Nothing here blocks the event loop: tracking only appends to the
+    collector's in-memory buffer, database work runs on a dedicated
+    single-thread executor, and batches are posted with aiohttp when it is
+    installed (otherwise the blocking transport runs in the executor).
+    Transmission is driven by a task on the loop instead of the sender
+    thread; the writer thread still persists buffered events.
+
+    Use ``async with AsyncTelemetryCollector() as telemetry:`` or call
+    ``start()``/``close()`` explicitly.
+    """
+    
+    def __init__(self, version: str = "1.0.0", endpoint: str = None,
+                 protocol: str = "json", compression: Optional[str] = None,
+                 config_dir: str = "~/.config/cursive-terminal",
+                 send_batch_size: int = 100, send_interval: float = 30.0):
+        self._options = {
+            "version": version, "endpoint": endpoint, "protocol": protocol,
+            "compression": compression, "config_dir": config_dir
         }
+        self.send_batch_size = send_batch_size
+        self.send_interval = send_interval
+        self.collector: Optional[TelemetryCollector] = None
         
-        for event in events:
-            # Count font usage
-            if event["font"]:
-                report["font_usage"][event["font"]] = report["font_usage"].get(event["font"], 0) + 1
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="telemetry-async")
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._start_lock: Optional[asyncio.Lock] = None
+        self._transmit_lock: Optional[asyncio.Lock] = None
+        self._send_wakeup: Optional[asyncio.Event] = None
+        self._sender: Optional[asyncio.Task] = None
+        self._session = None
+    
+    async def __aenter__(self) -> "AsyncTelemetryCollector":
+        await self.start()
+        return self
+    
+    async def __aexit__(self, exc_type, exc_value, traceback) -> None:
+        await self.close()
+    
+    async def _run(self, func: Callable, *args) -> Any:
+        """Run blocking work on the telemetry executor"""
+        return await self._loop.run_in_executor(self._executor, func, *args)
+    
+    async def start(self) -> None:
+        """Open the database and detect the system off the event loop"""
+        if self.collector is not None:
+            return
+        
+        if self._start_lock is None:
+            self._loop = asyncio.get_running_loop()
+            self._start_lock = asyncio.Lock()
+            self._transmit_lock = asyncio.Lock()
+            self._send_wakeup = asyncio.Event()
+        
+        async with self._start_lock:
+            if self.collector is not None:
+                return
+            
+            def build() -> TelemetryCollector:
+                collector = TelemetryCollector(**self._options)
+                # Warm the lazily detected fields used by every event
+                collector.platform_name
+                collector.terminal
+                return collector
+            
+            collector = await self._run(build)
+            # The writer's threshold trigger wakes the async sender instead
+            collector.writer.send = self._request_send
+            collector.writer.send_batch_size = self.send_batch_size
+            self.collector = collector
+            self._sender = self._loop.create_task(self._send_loop())
+    
+    def _request_send(self, max_events: int) -> bool:
+        """Called from the writer thread once enough events are stored"""
+        if self._loop is not None and not self._loop.is_closed():
+            self._loop.call_soon_threadsafe(self._send_wakeup.set)
+        return True
+    
+    async def _send_loop(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self._send_wakeup.wait(), self.send_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._send_wakeup.clear()
+            
+            try:
+                await self.transmit_events(self.send_batch_size)
+            except Exception as e:
+                print(f"Error transmitting telemetry events: {e}")
+    
+    async def track_event(self, event_type: str, properties: Dict[str, Any] = None,
+                          font: str = None, category: str = "analytics_enabled") -> None:
+        """Track a telemetry event without blocking the loop"""
+        await self.start()
+        self.collector.track_event(event_type, properties, font, category)
+    
+    async def track_error(self, error_type: str, error_message: str,
+                          context: Dict[str, Any] = None) -> None:
+        """Track error events"""
+        await self.start()
+        self.collector.track_error(error_type, error_message, context)
+    
+    async def track_performance(self, operation: str, duration_ms: float,
+                                success: bool = True) -> None:
+        """Track performance metrics"""
+        await self.start()
+        self.collector.track_performance(operation, duration_ms, success)
+    
+    async def track_feature_usage(self, feature: str, action: str = "used",
+                                  properties: Dict[str, Any] = None) -> None:
+        """Track feature usage"""
+        await self.start()
+        self.collector.track_feature_usage(feature, action, properties)
+    
+    def timed(self, operation: str) -> TimedOperation:
+        """Time a block or coroutine as ``operation`` (requires start())"""
+        return self.collector.timed(operation)
+    
+    async def _post(self, batch: Dict[str, Any]) -> bool:
+        """Send one leased batch, asynchronously when aiohttp is available"""
+        transport = self.collector.transport
+        if self._session is None:
+            # Imported on the executor by the first send, as it is slow to load
+            aiohttp = await self._run(_optional_module, "aiohttp")
+            if aiohttp is None:
+                return await self._run(transport.send, batch["events"], batch["histograms"])
             
-            # Count feature usage
-            if event["event_type"] == "feature_usage":
-                properties = json.loads(event["properties"] or "{}")
-                feature = properties.get("feature", "unknown")
-                report["feature_usage"][feature] = report["feature_usage"].get(feature, 0) + 1
+            self._session = aiohttp.ClientSession(
+                headers={
+                    "User-Agent": f"CursiveTerminal/{transport.version}",
+                    transport.MAX_BATCH_HEADER: str(transport.max_batch_size)
+                },
+                timeout=aiohttp.ClientTimeout(total=transport.timeout)
+            )
+        
+        body, headers = await self._run(
+            lambda: transport.encode(transport.build_payload(batch["events"], batch["histograms"]))
+        )
+        async with self._session.post(transport.endpoint, data=body, headers=headers) as response:
+            return transport.handle_response(response.status, response.headers, len(batch["events"]))
+    
+    async def transmit_events(self, max_events: int = 100) -> bool:
+        """Transmit stored events to the analytics endpoint"""
+        await self.start()
+        collector = self.collector
+        if not collector.is_enabled("analytics_enabled"):
+            return False
+        
+        async with self._transmit_lock:
+            if not await self._run(collector.backoff.allow):
+                return False
+            if not await self._run(collector.sender_lock.acquire):
+                return False
             
-            # Count errors
-            if event["event_type"] == "error":
-                report["error_count"] += 1
+            try:
+                batch = await self._run(collector._claim_batch, max_events)
+                if batch is None:
+                    return False
+                if not batch["events"] and not batch["histograms"]:
+                    return True
+                
+                try:
+                    sent = await self._post(batch)
+                except Exception:
+                    sent = False
+                
+                return await self._run(collector._complete_batch, batch, sent)
+            finally:
+                await self._run(collector.sender_lock.release)
+    
+    async def flush(self, transmit: bool = True) -> None:
+        """Write buffered events to disk and optionally transmit them"""
+        await self.start()
+        await self._run(self.collector.writer.flush, False)
+        if transmit:
+            await self.transmit_events(self.send_batch_size)
+    
+    async def generate_usage_report(self, days: int = 30) -> Dict[str, Any]:
+        """Generate a local usage report"""
+        await self.start()
+        return await self._run(self.collector.generate_usage_report, days)
+    
+    async def close(self, transmit: bool = True) -> None:
+        """Drain buffered events, stop the sender and release resources"""
+        if self.collector is None:
+            self._executor.shutdown(wait=False)
+            return
+        
+        if self._sender is not None:
+            self._sender.cancel()
+            try:
+                await self._sender
+            except asyncio.CancelledError:
+                pass
+            self._sender = None
         
-        return report
+        await self._run(self.collector.writer.close, False)
+        if transmit:
+            await self.transmit_events(self.send_batch_size)
+        
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+        
+        await self._run(self.collector.close)
+        self._executor.shutdown(wait=False)
+
+_default_collector: Optional[TelemetryCollector] = None
+_default_collector_lock = threading.Lock()
+_default_privacy: Optional[PrivacyManager] = None
+
+def default_privacy() -> PrivacyManager:
+    """Privacy settings of the default collector, readable before it exists"""
+    global _default_privacy
+    if _default_privacy is None:
+        with _default_collector_lock:
+            if _default_privacy is None:
+                _default_privacy = PrivacyManager()
+    return _default_privacy
+
+def default_collector() -> TelemetryCollector:
+    """Collector shared by module-level instrumentation, created on first use"""
+    global _default_collector
+    if _default_collector is None:
+        with _default_collector_lock:
+            if _default_collector is None:
+                _default_collector = TelemetryCollector()
+    return _default_collector
+
+def timed(operation: str) -> TimedOperation:
+    """Time a block or function with the default collector"""
+    return TimedOperation(operation)
 
 def main():
     """Example usage and testing"""
+    parser = argparse.ArgumentParser(description="Cursive Terminal telemetry")
+    parser.add_argument("command", nargs="?", default="demo",
+                        choices=["demo", "rebuild-rollups", "export", "migrate"],
+                        help="Run the demo, rebuild the report rollups, export events "
+                             "or finish schema migrations")
+    parser.add_argument("--output", default="telemetry_export.ndjson",
+                        help="Export destination")
+    parser.add_argument("--format", default="ndjson",
+                        choices=["ndjson", "parquet", "csv", "columnar"],
+                        help="Export file format")
+    parser.add_argument("--since", help="Export events at or after this UTC date/time")
+    parser.add_argument("--until", help="Export events before this UTC date/time")
+    parser.add_argument("--event-type", action="append", dest="event_types",
+                        help="Export only this event type (repeatable)")
+    args = parser.parse_args()
+    
+    if args.command == "rebuild-rollups":
+        with LocalDatabase() as database:
+            database.rebuild_rollups()
+        print("Rollups rebuilt")
+        return
+    
+    if args.command == "migrate":
+        with LocalDatabase() as database:
+            database.run_backfills()
+            print(f"Schema version {database.schema_version()}")
+        return
+    
+    if args.command == "export":
+        with LocalDatabase() as database:
+            try:
+                count = database.export_events(args.output, args.format, args.since,
+                                               args.until, args.event_types)
+            except (RuntimeError, ValueError) as e:
+                print(f"Export failed: {e}")
+                return
+        print(f"Exported {count} events to {args.output}")
+        return
+    
     collector = TelemetryCollector(version="1.0.0")
     
     # Test various tracking functions
@@ -478,6 +2891,7 @@ def main():
     collector.track_terminal_config("iTerm2", "Victor Mono", "cursive-elegance")
     collector.track_feature_usage("font_preview", "generated")
     collector.track_performance("font_installation", 2500, True)
+    collector.flush(transmit=False)
     
     # Generate and display usage report
     report = collector.generate_usage_report(30)
@@ -486,6 +2900,8 @@ def main():
     # Attempt to transmit events
     success = collector.transmit_events()
     print(f"Transmission successful: {success}")
+    
+    collector.close()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
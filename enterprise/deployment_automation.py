@@ -8,6 +8,7 @@ import asyncio
 import json
 import os
 import subprocess
+import sys
 import tempfile
 from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime, timezone
@@ -20,6 +21,10 @@ import time
 from dataclasses import dataclass, asdict
 from enum import Enum
 
+# Also run as a script, so make the repository root importable for analytics
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from analytics import timed
+
 class DeploymentStatus(Enum):
     PENDING = "pending"
     RUNNING = "running"
@@ -518,6 +523,7 @@ echo "Health check completed"
         
         return deployment.status == DeploymentStatus.SUCCESS
     
+    @timed("deployment.execute_task")
     async def _execute_task(self, task: DeploymentTask, semaphore: asyncio.Semaphore,
                            progress_callback: Callable[[str, Dict], None] = None) -> bool:
         """Execute a single deployment task"""
@@ -4,21 +4,38 @@ Cursive Terminal - Enterprise License Management
 Handles license validation, seat management, and feature restrictions
 """
 
+import atexit
 import json
 import hashlib
 import hmac
 import base64
+import getpass
+import os
+import platform
+import sqlite3
+import sys
+import threading
 import time
+from contextlib import contextmanager
 from datetime import datetime, timezone, timedelta
 from pathlib import Path
-from typing import Dict, List, Optional, Any, Tuple
+from typing import Dict, List, Optional, Any, Tuple, Iterator
 import uuid
 import requests
-from dataclasses import dataclass, asdict
+from dataclasses import dataclass, asdict, replace
 from cryptography.fernet import Fernet
 from cryptography.hazmat.primitives import hashes
 from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
 
+# Also run as a script, so make the repository root importable for analytics
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from analytics import timed
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
 @dataclass
 class License:
     """Represents an enterprise license"""
@@ -53,6 +70,510 @@ class Feature:
     license_types: List[str]  # Which license types include this feature
     usage_limit: Optional[int] = None  # Usage limit if applicable
 
+class SeatRegistry:
+    """Seat assignments indexed by id, user email and status
+
+    Iterates in assignment order. Status changes must go through
+    ``set_status`` so the indexes and the active seat count stay in step.
+    """
+    
+    def __init__(self, seats: List[Seat] = None):
+        self._by_id: Dict[str, Seat] = {}
+        self._by_email: Dict[str, Dict[str, Seat]] = {}
+        self._by_status: Dict[str, Dict[str, Seat]] = {}
+        self._active_by_email: Dict[str, Seat] = {}
+        
+        for seat in seats or []:
+            self.add(seat)
+    
+    def __iter__(self):
+        return iter(list(self._by_id.values()))
+    
+    def __len__(self) -> int:
+        return len(self._by_id)
+    
+    @property
+    def active_count(self) -> int:
+        """Number of seats currently active"""
+        return len(self._by_status.get("active", {}))
+    
+    def add(self, seat: Seat) -> None:
+        """Register a seat"""
+        self._by_id[seat.id] = seat
+        self._by_email.setdefault(seat.user_email, {})[seat.id] = seat
+        self._by_status.setdefault(seat.status, {})[seat.id] = seat
+        if seat.status == "active":
+            self._active_by_email.setdefault(seat.user_email, seat)
+    
+    def get(self, seat_id: str) -> Optional[Seat]:
+        """Seat with the given id"""
+        return self._by_id.get(seat_id)
+    
+    def active_seat(self, user_email: str) -> Optional[Seat]:
+        """The user's active seat, if any"""
+        return self._active_by_email.get(user_email)
+    
+    def seats_for(self, user_email: str) -> List[Seat]:
+        """Every seat ever assigned to a user, oldest first"""
+        return list(self._by_email.get(user_email, {}).values())
+    
+    def with_status(self, status: str) -> List[Seat]:
+        """Seats in the given status"""
+        return list(self._by_status.get(status, {}).values())
+    
+    def set_status(self, seat: Seat, status: str) -> None:
+        """Change a seat's status, keeping the indexes consistent"""
+        self._by_status.get(seat.status, {}).pop(seat.id, None)
+        if self._active_by_email.get(seat.user_email) is seat:
+            del self._active_by_email[seat.user_email]
+            # Fall back to another active seat for the same user, if any
+            for other in self._by_email[seat.user_email].values():
+                if other is not seat and other.status == "active":
+                    self._active_by_email[seat.user_email] = other
+                    break
+        
+        seat.status = status
+        self._by_status.setdefault(status, {})[seat.id] = seat
+        if status == "active":
+            self._active_by_email.setdefault(seat.user_email, seat)
+
+class LicenseStore:
+    """SQLite storage for seat assignments and usage statistics
+
+    Every change is a row-level upsert in its own short transaction, so
+    recording a feature use or a seat change costs one small write however
+    many seats or usage records exist.
+    """
+    
+    SEAT_COLUMNS = [
+        "id", "license_key", "user_email", "user_name", "assigned_date",
+        "last_activity", "device_fingerprint", "status"
+    ]
+    
+    def __init__(self, db_path: Path, busy_timeout: float = 30.0):
+        self.db_path = Path(db_path)
+        self.busy_timeout = busy_timeout
+        self._lock = threading.RLock()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._conn_pid: Optional[int] = None
+        self.init_database()
+    
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_path, check_same_thread=False, timeout=self.busy_timeout)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+    
+    @contextmanager
+    def transaction(self) -> Iterator[sqlite3.Connection]:
+        """Yield the shared connection inside a locked transaction"""
+        with self._lock:
+            # A forked child must not reuse the parent's connection
+            if self._conn is None or self._conn_pid != os.getpid():
+                self._conn = self._connect()
+                self._conn_pid = os.getpid()
+            
+            with self._conn:
+                yield self._conn
+    
+    def close(self) -> None:
+        """Close the connection; it is reopened on next use"""
+        with self._lock:
+            if self._conn is not None and self._conn_pid == os.getpid():
+                self._conn.close()
+            self._conn = None
+            self._conn_pid = None
+    
+    def init_database(self) -> None:
+        """Create the storage tables"""
+        with self.transaction() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS seats (
+                    id TEXT PRIMARY KEY,
+                    license_key TEXT NOT NULL,
+                    user_email TEXT NOT NULL,
+                    user_name TEXT NOT NULL,
+                    assigned_date TEXT NOT NULL,
+                    last_activity TEXT NOT NULL,
+                    device_fingerprint TEXT NOT NULL,
+                    status TEXT NOT NULL
+                )
+            """)
+            
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_seats_email ON seats(user_email)")
+            
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS daily_usage (
+                    day TEXT NOT NULL,
+                    feature TEXT NOT NULL,
+                    count INTEGER NOT NULL,
+                    PRIMARY KEY (day, feature)
+                ) WITHOUT ROWID
+            """)
+            
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS feature_users (
+                    feature TEXT NOT NULL,
+                    user_email TEXT NOT NULL,
+                    count INTEGER NOT NULL,
+                    PRIMARY KEY (feature, user_email)
+                ) WITHOUT ROWID
+            """)
+            
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS user_activity (
+                    user_email TEXT PRIMARY KEY,
+                    last_activity TEXT NOT NULL,
+                    total_usage INTEGER NOT NULL
+                ) WITHOUT ROWID
+            """)
+            
+            conn.execute("""
+                CREATE INDEX IF NOT EXISTS idx_user_activity_last ON user_activity(last_activity)
+            """)
+            
+            # JSON files from older versions already imported
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS imported_files (
+                    name TEXT PRIMARY KEY
+                )
+            """)
+            
+            # Usage journal segments already applied, so replaying a segment
+            # that was applied but not yet deleted is a no-op
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS applied_journals (
+                    name TEXT PRIMARY KEY,
+                    applied_at REAL NOT NULL
+                )
+            """)
+    
+    def load_seats(self) -> List[Seat]:
+        """Every seat in assignment order"""
+        with self.transaction() as conn:
+            rows = conn.execute(f"SELECT {', '.join(self.SEAT_COLUMNS)} FROM seats ORDER BY rowid")
+            return [Seat(**dict(row)) for row in rows]
+    
+    def save_seats(self, seats: List[Seat]) -> None:
+        """Insert or update seats in one transaction"""
+        with self.transaction() as conn:
+            self._save_seats(conn, seats)
+    
+    def _save_seats(self, conn: sqlite3.Connection, seats: List[Seat]) -> None:
+        placeholders = ", ".join("?" * len(self.SEAT_COLUMNS))
+        updates = ", ".join(f"{column} = excluded.{column}" for column in self.SEAT_COLUMNS[1:])
+        conn.executemany(f"""
+            INSERT INTO seats ({', '.join(self.SEAT_COLUMNS)}) VALUES ({placeholders})
+            ON CONFLICT(id) DO UPDATE SET {updates}
+        """, [tuple(getattr(seat, column) for column in self.SEAT_COLUMNS) for seat in seats])
+    
+    def save_seat(self, seat: Seat) -> None:
+        """Insert or update a single seat"""
+        self.save_seats([seat])
+    
+    def record_feature_use(self, feature: str, user_email: str, timestamp: str) -> None:
+        """Count one use of a feature by a user"""
+        with self.transaction() as conn:
+            self._record_feature_uses(conn, [(feature, user_email, timestamp, 1)])
+    
+    def apply_journal(self, name: str, uses: List[tuple]) -> bool:
+        """Apply a journal segment's increments once; False if already applied"""
+        with self.transaction() as conn:
+            if conn.execute("SELECT 1 FROM applied_journals WHERE name = ?", (name,)).fetchone():
+                return False
+            self._record_feature_uses(conn, uses)
+            conn.execute("INSERT INTO applied_journals (name, applied_at) VALUES (?, ?)",
+                         (name, time.time()))
+        return True
+    
+    def prune_journals(self, max_age: float) -> None:
+        """Drop applied markers older than ``max_age`` seconds"""
+        with self.transaction() as conn:
+            conn.execute("DELETE FROM applied_journals WHERE applied_at < ?",
+                         (time.time() - max_age,))
+    
+    def _record_feature_uses(self, conn: sqlite3.Connection, uses: List[tuple]) -> None:
+        """Apply (feature, user_email, timestamp, count) increments"""
+        conn.executemany("""
+            INSERT INTO daily_usage (day, feature, count) VALUES (substr(?, 1, 10), ?, ?)
+            ON CONFLICT(day, feature) DO UPDATE SET count = count + excluded.count
+        """, [(timestamp, feature, count) for feature, _, timestamp, count in uses])
+        conn.executemany("""
+            INSERT INTO feature_users (feature, user_email, count) VALUES (?, ?, ?)
+            ON CONFLICT(feature, user_email) DO UPDATE SET count = count + excluded.count
+        """, [(feature, user_email, count) for feature, user_email, _, count in uses])
+        conn.executemany("""
+            INSERT INTO user_activity (user_email, last_activity, total_usage) VALUES (?, ?, ?)
+            ON CONFLICT(user_email) DO UPDATE SET
+                last_activity = MAX(last_activity, excluded.last_activity),
+                total_usage = total_usage + excluded.total_usage
+        """, [(user_email, timestamp, count) for _, user_email, timestamp, count in uses])
+    
+    def daily_usage(self, since: str = "") -> Dict[str, Dict[str, int]]:
+        """Per-day feature counts from ``since`` (an ISO date) on"""
+        usage: Dict[str, Dict[str, int]] = {}
+        with self.transaction() as conn:
+            for row in conn.execute("""
+                SELECT day, feature, count FROM daily_usage WHERE day >= ? ORDER BY day
+            """, (since,)):
+                usage.setdefault(row["day"], {})[row["feature"]] = row["count"]
+        return usage
+    
+    def feature_usage(self) -> Dict[str, Dict[str, Any]]:
+        """Total uses and distinct users per feature"""
+        usage: Dict[str, Dict[str, Any]] = {}
+        with self.transaction() as conn:
+            for row in conn.execute("SELECT feature, user_email, count FROM feature_users"):
+                entry = usage.setdefault(row["feature"], {"total": 0, "users": []})
+                entry["total"] += row["count"]
+                entry["users"].append(row["user_email"])
+        return usage
+    
+    def user_activity(self) -> Dict[str, Dict[str, Any]]:
+        """Last activity, total uses and features used per user"""
+        activity: Dict[str, Dict[str, Any]] = {}
+        with self.transaction() as conn:
+            for row in conn.execute("SELECT user_email, last_activity, total_usage FROM user_activity"):
+                activity[row["user_email"]] = {
+                    "last_activity": row["last_activity"],
+                    "total_usage": row["total_usage"],
+                    "features_used": []
+                }
+            # Imported usage may list users with no activity record
+            for row in conn.execute("SELECT feature, user_email FROM feature_users"):
+                activity.setdefault(row["user_email"], {
+                    "last_activity": None,
+                    "total_usage": 0,
+                    "features_used": []
+                })["features_used"].append(row["feature"])
+        return activity
+    
+    def count_active_users(self, since: str) -> int:
+        """Users with activity after an ISO-8601 timestamp"""
+        with self.transaction() as conn:
+            return conn.execute("""
+                SELECT COUNT(*) FROM user_activity WHERE last_activity > ?
+            """, (since,)).fetchone()[0]
+    
+    def import_json(self, seats_file: Path, usage_file: Path) -> None:
+        """Move seats.json/usage.json from older versions into the store
+
+        Each import is recorded in the same transaction that applies it, so
+        a file is never applied twice; it is then renamed with a
+        ``.migrated`` suffix, and the rename is retried on a later start if
+        it fails.
+        """
+        if seats_file.exists():
+            try:
+                with open(seats_file) as f:
+                    seats = [Seat(**seat) for seat in json.load(f)]
+                with self.transaction() as conn:
+                    if self._claim_import(conn, seats_file.name):
+                        self._save_seats(conn, seats)
+                seats_file.rename(seats_file.with_suffix(".json.migrated"))
+            except Exception as e:
+                print(f"Error migrating seats: {e}")
+        
+        if usage_file.exists():
+            try:
+                with open(usage_file) as f:
+                    usage = json.load(f)
+                with self.transaction() as conn:
+                    if self._claim_import(conn, usage_file.name):
+                        self._import_usage(conn, usage)
+                usage_file.rename(usage_file.with_suffix(".json.migrated"))
+            except Exception as e:
+                print(f"Error migrating usage stats: {e}")
+    
+    @staticmethod
+    def _claim_import(conn: sqlite3.Connection, name: str) -> bool:
+        """Record a file as imported; False if it already was"""
+        return conn.execute("""
+            INSERT INTO imported_files (name) VALUES (?) ON CONFLICT(name) DO NOTHING
+        """, (name,)).rowcount == 1
+    
+    def _import_usage(self, conn: sqlite3.Connection, usage: Dict[str, Any]) -> None:
+        # The JSON format kept per-feature totals and user lists but not
+        # per-user counts, so each (feature, user) pair is credited once
+        # and the remainder of the total goes to the first listed user
+        conn.executemany("""
+            INSERT INTO daily_usage (day, feature, count) VALUES (?, ?, ?)
+            ON CONFLICT(day, feature) DO UPDATE SET count = count + excluded.count
+        """, [
+            (day, feature, count)
+            for day, features in usage.get("daily_usage", {}).items()
+            for feature, count in features.items()
+        ])
+        
+        for feature, data in usage.get("feature_usage", {}).items():
+            users = list(data.get("users", []))
+            if not users:
+                continue
+            counts = {user: 1 for user in users}
+            counts[users[0]] += max(0, data.get("total", 0) - len(users))
+            conn.executemany("""
+                INSERT INTO feature_users (feature, user_email, count) VALUES (?, ?, ?)
+                ON CONFLICT(feature, user_email) DO UPDATE SET count = count + excluded.count
+            """, [(feature, user, count) for user, count in counts.items()])
+        
+        conn.executemany("""
+            INSERT INTO user_activity (user_email, last_activity, total_usage) VALUES (?, ?, ?)
+            ON CONFLICT(user_email) DO UPDATE SET
+                last_activity = MAX(last_activity, excluded.last_activity),
+                total_usage = total_usage + excluded.total_usage
+        """, [
+            (user, data.get("last_activity", ""), data.get("total_usage", 0))
+            for user, data in usage.get("user_activity", {}).items()
+        ])
+
+class UsageBuffer:
+    """Write-behind buffer for feature usage counters
+
+    ``record`` bumps an in-memory counter and appends the increment to this
+    instance's journal file before returning. Counters are written to the
+    store in one transaction by a background thread every
+    ``flush_interval`` seconds or once ``max_pending`` uses accumulate, on
+    ``flush()`` and at exit. Each flush starts a new journal segment; a segment is deleted
+    once applied, and segments left behind by a crashed process are
+    replayed on startup. The store remembers applied segments for
+    ``MARKER_RETENTION`` seconds, so a segment read by two processes at
+    once is still only counted once.
+    """
+    
+    MARKER_RETENTION = 7 * 24 * 60 * 60
+    
+    def __init__(self, store: LicenseStore, journal_dir: Path,
+                 flush_interval: float = 5.0, max_pending: int = 1000):
+        self.store = store
+        self.journal_dir = Path(journal_dir)
+        self.journal_dir.mkdir(parents=True, exist_ok=True)
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        
+        self._lock = threading.RLock()
+        self._instance = uuid.uuid4().hex
+        self._segment = 0
+        self._journal = None
+        self._pending: Dict[tuple, list] = {}
+        self._pending_count = 0
+        self._closed = threading.Event()
+        self._wakeup = threading.Event()
+        self._timer: Optional[threading.Thread] = None
+        
+        self.recover()
+        atexit.register(self.close)
+    
+    def _open_journal(self) -> None:
+        self._segment += 1
+        path = self.journal_dir / f"usage-{self._instance}-{self._segment}.journal"
+        # Line buffered: each increment reaches the OS before record returns
+        self._journal = open(path, "a", buffering=1)
+        if fcntl is not None:
+            # Held while this segment is live so recover() leaves it alone
+            fcntl.flock(self._journal, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    
+    def record(self, feature: str, user_email: str) -> None:
+        """Count one use of a feature by a user"""
+        timestamp = datetime.now(timezone.utc).isoformat()
+        key = (feature, user_email, timestamp[:10])
+        
+        with self._lock:
+            if self._journal is None:
+                self._open_journal()
+                if self._timer is None:
+                    self._timer = threading.Thread(target=self._flush_loop,
+                                                   name="usage-flush", daemon=True)
+                    self._timer.start()
+            self._journal.write(json.dumps([feature, user_email, timestamp]) + "\n")
+            
+            entry = self._pending.get(key)
+            if entry is None:
+                self._pending[key] = [1, timestamp]
+            else:
+                entry[0] += 1
+                entry[1] = timestamp
+            self._pending_count += 1
+            
+            if self._pending_count >= self.max_pending:
+                self._wakeup.set()
+    
+    def _flush_loop(self) -> None:
+        while not self._closed.is_set():
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"Error flushing usage journal: {e}")
+    
+    def flush(self) -> None:
+        """Write pending counters to the store and retire their journal"""
+        # Only the swap holds the lock, so record() never waits on SQLite;
+        # a segment that fails to apply stays on disk for recover()
+        with self._lock:
+            if self._journal is None:
+                return
+            
+            journal, self._journal = self._journal, None
+            pending, self._pending = self._pending, {}
+            self._pending_count = 0
+            journal.close()
+        
+        path = Path(journal.name)
+        uses = [
+            (feature, user_email, timestamp, count)
+            for (feature, user_email, _), (count, timestamp) in pending.items()
+        ]
+        self.store.apply_journal(path.name, uses)
+        # recover() in another process may have applied and removed it
+        path.unlink(missing_ok=True)
+    
+    def recover(self) -> None:
+        """Replay journal segments left behind by processes that exited"""
+        self.store.prune_journals(self.MARKER_RETENTION)
+        
+        for path in sorted(self.journal_dir.glob("usage-*.journal")):
+            try:
+                with open(path) as f:
+                    if fcntl is not None:
+                        try:
+                            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                        except OSError:
+                            continue  # Live segment of another process
+                    elif time.time() - os.fstat(f.fileno()).st_mtime < 2 * self.flush_interval:
+                        # Without flock, a recently written segment may still
+                        # be live; its owner flushes within flush_interval
+                        continue
+                    lines = f.read().splitlines()
+                
+                counts: Dict[tuple, list] = {}
+                for line in lines:
+                    try:
+                        feature, user_email, timestamp = json.loads(line)
+                    except ValueError:
+                        continue  # Torn final line from a crash mid-write
+                    entry = counts.setdefault((feature, user_email, timestamp[:10]), [0, timestamp])
+                    entry[0] += 1
+                    entry[1] = max(entry[1], timestamp)
+                
+                self.store.apply_journal(path.name, [
+                    (feature, user_email, timestamp, count)
+                    for (feature, user_email, _), (count, timestamp) in counts.items()
+                ])
+                path.unlink(missing_ok=True)
+            except FileNotFoundError:
+                pass  # Replayed by another process first
+            except Exception as e:
+                print(f"Error replaying usage journal {path.name}: {e}")
+    
+    def close(self) -> None:
+        """Stop the timer, flush and stop journaling"""
+        self._closed.set()
+        self._wakeup.set()
+        self.flush()
+        atexit.unregister(self.close)
+
 class LicenseManager:
     """Manages enterprise licenses and seat assignments"""
     
@@ -88,7 +609,8 @@ class LicenseManager:
         ]
     }
     
-    def __init__(self, config_dir: str = "~/.config/cursive-terminal-enterprise"):
+    def __init__(self, config_dir: str = "~/.config/cursive-terminal-enterprise",
+                 persist_fingerprint: bool = False):
         self.config_dir = Path(config_dir).expanduser()
         self.config_dir.mkdir(parents=True, exist_ok=True)
         
@@ -96,14 +618,23 @@ class LicenseManager:
         self.license_file = self.config_dir / "license.json"
         self.seats_file = self.config_dir / "seats.json"
         self.usage_file = self.config_dir / "usage.json"
+        self.fingerprint_file = self.config_dir / ".device_fingerprint" if persist_fingerprint else None
+        
+        # Computed on first use; see invalidate_caches
+        self._fernet: Optional[Fernet] = None
+        self._device_fingerprint: Optional[str] = None
         
         # Encryption key for local storage
         self.encryption_key = self._get_or_create_encryption_key()
         
+        # Seats and usage live in SQLite; older JSON files are imported once
+        self.store = LicenseStore(self.config_dir / "license.db")
+        self.store.import_json(self.seats_file, self.usage_file)
+        self.usage_buffer = UsageBuffer(self.store, self.config_dir / "usage-journal")
+        
         # Load existing data
         self.license = self._load_license()
         self.seats = self._load_seats()
-        self.usage_stats = self._load_usage_stats()
         
         # License server URL
         self.license_server = "https://license.cursiveterminal.com"
@@ -121,15 +652,38 @@ class LicenseManager:
         key_file.chmod(0o600)  # Restrict permissions
         return key
     
+    @property
+    def encryption_key(self) -> bytes:
+        return self._encryption_key
+    
+    @encryption_key.setter
+    def encryption_key(self, key: bytes) -> None:
+        self._encryption_key = key
+        self._fernet = None
+    
+    def _get_fernet(self) -> Fernet:
+        """Fernet instance for the current encryption key"""
+        if self._fernet is None:
+            self._fernet = Fernet(self.encryption_key)
+        return self._fernet
+    
     def _encrypt_data(self, data: str) -> str:
         """Encrypt sensitive data for local storage"""
-        f = Fernet(self.encryption_key)
-        return f.encrypt(data.encode()).decode()
+        return self._get_fernet().encrypt(data.encode()).decode()
     
     def _decrypt_data(self, encrypted_data: str) -> str:
         """Decrypt sensitive data from local storage"""
-        f = Fernet(self.encryption_key)
-        return f.decrypt(encrypted_data.encode()).decode()
+        return self._get_fernet().decrypt(encrypted_data.encode()).decode()
+    
+    def invalidate_caches(self) -> None:
+        """Forget the cached Fernet instance and device fingerprint, including the persisted one"""
+        self._fernet = None
+        self._device_fingerprint = None
+        if self.fingerprint_file is not None:
+            try:
+                self.fingerprint_file.unlink()
+            except FileNotFoundError:
+                pass
     
     def _load_license(self) -> Optional[License]:
         """Load license from local storage"""
@@ -152,44 +706,25 @@ class LicenseManager:
             with open(self.license_file, 'w') as f:
                 f.write(encrypted_data)
     
-    def _load_seats(self) -> List[Seat]:
+    def _load_seats(self) -> SeatRegistry:
         """Load seat assignments from local storage"""
-        if self.seats_file.exists():
-            try:
-                with open(self.seats_file) as f:
-                    data = json.load(f)
-                    return [Seat(**seat) for seat in data]
-            except Exception as e:
-                print(f"Error loading seats: {e}")
-        return []
-    
-    def _save_seats(self) -> None:
-        """Save seat assignments to local storage"""
-        with open(self.seats_file, 'w') as f:
-            json.dump([asdict(seat) for seat in self.seats], f, indent=2)
+        try:
+            return SeatRegistry(self.store.load_seats())
+        except Exception as e:
+            print(f"Error loading seats: {e}")
+        return SeatRegistry()
     
-    def _load_usage_stats(self) -> Dict[str, Any]:
-        """Load usage statistics"""
-        if self.usage_file.exists():
-            try:
-                with open(self.usage_file) as f:
-                    return json.load(f)
-            except Exception as e:
-                print(f"Error loading usage stats: {e}")
-        
+    @property
+    def usage_stats(self) -> Dict[str, Any]:
+        """Usage statistics in the format sent to the license server"""
+        self.flush()
         return {
-            "daily_usage": {},
-            "feature_usage": {},
-            "user_activity": {},
+            "daily_usage": self.store.daily_usage(),
+            "feature_usage": self.store.feature_usage(),
+            "user_activity": self.store.user_activity(),
             "last_updated": datetime.now(timezone.utc).isoformat()
         }
     
-    def _save_usage_stats(self) -> None:
-        """Save usage statistics"""
-        self.usage_stats["last_updated"] = datetime.now(timezone.utc).isoformat()
-        with open(self.usage_file, 'w') as f:
-            json.dump(self.usage_stats, f, indent=2)
-    
     def validate_license_key(self, license_key: str) -> Tuple[bool, str]:
         """Validate license key format and checksum"""
         if not license_key or len(license_key) != 36:
@@ -291,7 +826,7 @@ class LicenseManager:
             return False, "License expired", {"expired": True, "expiry_date": self.license.expiry_date}
         
         # Check seat usage
-        active_seats = len([s for s in self.seats if s.status == "active"])
+        active_seats = self.seats.active_count
         
         status_info = {
             "license_type": self.license.license_type,
@@ -308,57 +843,94 @@ class LicenseManager:
     
     def assign_seat(self, user_email: str, user_name: str) -> Tuple[bool, str]:
         """Assign a seat to a user"""
+        result = self.assign_seats([(user_email, user_name)])[0]
+        return result["success"], result["message"]
+    
+    def assign_seats(self, users: List[Tuple[str, str]]) -> List[Dict[str, Any]]:
+        """Assign seats to many (email, name) pairs with one commit
+
+        The license is validated and the device fingerprint computed once.
+        Users are taken in order until the license is full. Returns one
+        ``{"user_email", "success", "message"}`` entry per input pair.
+        """
         if not self.license:
-            return False, "No active license"
+            return [self._seat_result(email, False, "No active license") for email, _ in users]
         
         # Check if license is valid
         is_valid, message, _ = self.check_license_status()
         if not is_valid:
-            return False, message
+            return [self._seat_result(email, False, message) for email, _ in users]
         
-        # Check seat availability
-        active_seats = len([s for s in self.seats if s.status == "active"])
-        if active_seats >= self.license.max_seats:
-            return False, "No available seats"
-        
-        # Check if user already has a seat
-        existing_seat = self.get_user_seat(user_email)
-        if existing_seat:
-            return False, "User already has an assigned seat"
-        
-        # Create new seat
-        seat = Seat(
-            id=str(uuid.uuid4()),
-            license_key=self.license.license_key,
-            user_email=user_email,
-            user_name=user_name,
-            assigned_date=datetime.now(timezone.utc).isoformat(),
-            last_activity=datetime.now(timezone.utc).isoformat(),
-            device_fingerprint=self._get_device_fingerprint(),
-            status="active"
-        )
+        now = datetime.now(timezone.utc).isoformat()
+        fingerprint = self._get_device_fingerprint()
+        available = self.license.max_seats - self.seats.active_count
         
-        self.seats.append(seat)
-        self._save_seats()
+        results, new_seats, seen = [], [], set()
+        for user_email, user_name in users:
+            # Check if user already has a seat
+            if user_email in seen or self.seats.active_seat(user_email):
+                results.append(self._seat_result(user_email, False, "User already has an assigned seat"))
+                continue
+            
+            # Check seat availability
+            if len(new_seats) >= available:
+                results.append(self._seat_result(user_email, False, "No available seats"))
+                continue
+            
+            seen.add(user_email)
+            new_seats.append(Seat(
+                id=str(uuid.uuid4()),
+                license_key=self.license.license_key,
+                user_email=user_email,
+                user_name=user_name,
+                assigned_date=now,
+                last_activity=now,
+                device_fingerprint=fingerprint,
+                status="active"
+            ))
+            results.append(self._seat_result(user_email, True, "Seat assigned successfully"))
         
-        return True, "Seat assigned successfully"
+        # Persist first so a failed write leaves memory and disk in step
+        self.store.save_seats(new_seats)
+        for seat in new_seats:
+            self.seats.add(seat)
+        
+        return results
     
     def revoke_seat(self, user_email: str) -> Tuple[bool, str]:
         """Revoke a seat from a user"""
-        for seat in self.seats:
-            if seat.user_email == user_email:
-                seat.status = "inactive"
-                self._save_seats()
-                return True, "Seat revoked successfully"
+        result = self.revoke_seats([user_email])[0]
+        return result["success"], result["message"]
+    
+    def revoke_seats(self, user_emails: List[str]) -> List[Dict[str, Any]]:
+        """Revoke the seats of many users with one commit"""
+        results, revoked = [], {}
+        for user_email in user_emails:
+            seat = self.seats.active_seat(user_email)
+            if seat is None:
+                seats = self.seats.seats_for(user_email)
+                seat = seats[0] if seats else None
+            
+            if seat is None:
+                results.append(self._seat_result(user_email, False, "User seat not found"))
+                continue
+            
+            revoked[seat.id] = seat
+            results.append(self._seat_result(user_email, True, "Seat revoked successfully"))
+        
+        self.store.save_seats([replace(seat, status="inactive") for seat in revoked.values()])
+        for seat in revoked.values():
+            self.seats.set_status(seat, "inactive")
         
-        return False, "User seat not found"
+        return results
+    
+    @staticmethod
+    def _seat_result(user_email: str, success: bool, message: str) -> Dict[str, Any]:
+        return {"user_email": user_email, "success": success, "message": message}
     
     def get_user_seat(self, user_email: str) -> Optional[Seat]:
         """Get seat information for a user"""
-        for seat in self.seats:
-            if seat.user_email == user_email and seat.status == "active":
-                return seat
-        return None
+        return self.seats.active_seat(user_email)
     
     def has_feature(self, feature: str) -> bool:
         """Check if current license includes a feature"""
@@ -372,96 +944,58 @@ class LicenseManager:
         seat = self.get_user_seat(user_email)
         if seat:
             seat.last_activity = datetime.now(timezone.utc).isoformat()
-            self._save_seats()
+            self.store.save_seat(seat)
     
     def track_feature_usage(self, feature: str, user_email: str) -> None:
         """Track feature usage for analytics"""
-        today = datetime.now(timezone.utc).date().isoformat()
-        
-        # Update daily usage
-        if today not in self.usage_stats["daily_usage"]:
-            self.usage_stats["daily_usage"][today] = {}
-        
-        if feature not in self.usage_stats["daily_usage"][today]:
-            self.usage_stats["daily_usage"][today][feature] = 0
-        
-        self.usage_stats["daily_usage"][today][feature] += 1
-        
-        # Update feature usage
-        if feature not in self.usage_stats["feature_usage"]:
-            self.usage_stats["feature_usage"][feature] = {"total": 0, "users": set()}
-        
-        self.usage_stats["feature_usage"][feature]["total"] += 1
-        self.usage_stats["feature_usage"][feature]["users"].add(user_email)
-        
-        # Convert sets to lists for JSON serialization
-        for feat_data in self.usage_stats["feature_usage"].values():
-            if isinstance(feat_data["users"], set):
-                feat_data["users"] = list(feat_data["users"])
-        
-        # Update user activity
-        if user_email not in self.usage_stats["user_activity"]:
-            self.usage_stats["user_activity"][user_email] = {
-                "last_activity": "",
-                "total_usage": 0,
-                "features_used": set()
-            }
-        
-        self.usage_stats["user_activity"][user_email]["last_activity"] = datetime.now(timezone.utc).isoformat()
-        self.usage_stats["user_activity"][user_email]["total_usage"] += 1
-        self.usage_stats["user_activity"][user_email]["features_used"].add(feature)
-        
-        # Convert sets to lists
-        for user_data in self.usage_stats["user_activity"].values():
-            if isinstance(user_data["features_used"], set):
-                user_data["features_used"] = list(user_data["features_used"])
-        
-        self._save_usage_stats()
+        self.usage_buffer.record(feature, user_email)
+    
+    def flush(self) -> None:
+        """Write buffered feature usage to the store"""
+        self.usage_buffer.flush()
     
     def generate_usage_report(self, days: int = 30) -> Dict[str, Any]:
         """Generate usage report for the license"""
         if not self.license:
             return {"error": "No active license"}
         
-        cutoff_date = (datetime.now(timezone.utc) - timedelta(days=days)).date().isoformat()
+        self.flush()
+        now = datetime.now(timezone.utc)
+        cutoff_date = (now - timedelta(days=days)).date().isoformat()
         
         # Filter recent usage
-        recent_usage = {}
-        for date, usage in self.usage_stats["daily_usage"].items():
-            if date >= cutoff_date:
-                recent_usage[date] = usage
+        recent_usage = self.store.daily_usage(since=cutoff_date)
         
         # Calculate totals
         total_usage = sum(
             sum(day_usage.values()) for day_usage in recent_usage.values()
         )
         
-        # Active users
-        active_users = set()
-        for user_email, user_data in self.usage_stats["user_activity"].items():
-            last_activity = datetime.fromisoformat(user_data["last_activity"].replace('Z', '+00:00'))
-            if (datetime.now(timezone.utc) - last_activity).days <= days:
-                active_users.add(user_email)
+        # Active users: whole days since last activity at most ``days``
+        active_users = self.store.count_active_users((now - timedelta(days=days + 1)).isoformat())
+        
+        feature_usage = self.store.feature_usage()
         
         return {
             "license_info": {
                 "license_type": self.license.license_type,
                 "organization": self.license.organization,
                 "max_seats": self.license.max_seats,
-                "used_seats": len([s for s in self.seats if s.status == "active"])
+                "used_seats": self.seats.active_count
             },
             "usage_period": f"Last {days} days",
             "total_usage": total_usage,
-            "active_users": len(active_users),
+            "active_users": active_users,
             "daily_usage": recent_usage,
-            "feature_usage": self.usage_stats["feature_usage"],
+            "feature_usage": feature_usage,
             "most_used_features": sorted(
-                self.usage_stats["feature_usage"].items(),
+                feature_usage.items(),
                 key=lambda x: x[1]["total"],
                 reverse=True
             )[:10]
         }
     
+    @timed("license.sync_with_server")
     def sync_with_server(self) -> Tuple[bool, str]:
         """Sync license status with server"""
         if not self.license:
@@ -490,10 +1024,53 @@ class LicenseManager:
             return False, f"Sync failed: {str(e)}"
     
     def _get_device_fingerprint(self) -> str:
-        """Generate device fingerprint for license binding"""
-        import platform
-        import getpass
+        """Device fingerprint for license binding, computed once per instance"""
+        if self._device_fingerprint is None:
+            self._device_fingerprint = self._load_device_fingerprint()
+        return self._device_fingerprint
+    
+    def _load_device_fingerprint(self) -> str:
+        """Read the persisted fingerprint, or compute and persist it"""
+        # platform.platform() may spawn subprocesses, so the persisted value
+        # is only matched against the cheap parts of the fingerprint here
+        # and fully re-checked in the background
+        owner = f"{platform.node()}:{getpass.getuser()}:{platform.python_version()}"
+        
+        if self.fingerprint_file is not None and self.fingerprint_file.exists():
+            try:
+                cached = json.loads(self.fingerprint_file.read_text())
+                if cached.get("owner") == owner:
+                    # Memoize before the check starts so a correction is not overwritten
+                    self._device_fingerprint = cached["fingerprint"]
+                    threading.Thread(target=self._revalidate_device_fingerprint,
+                                     args=(owner, cached["fingerprint"]),
+                                     name="fingerprint-check", daemon=True).start()
+                    return cached["fingerprint"]
+            except (ValueError, KeyError, OSError):
+                pass
         
+        fingerprint = self._compute_device_fingerprint()
+        self._save_device_fingerprint(owner, fingerprint)
+        return fingerprint
+    
+    def _revalidate_device_fingerprint(self, owner: str, cached: str) -> None:
+        """Replace a persisted fingerprint the system no longer matches, e.g. after an OS upgrade"""
+        fingerprint = self._compute_device_fingerprint()
+        if fingerprint != cached:
+            self._device_fingerprint = fingerprint
+            self._save_device_fingerprint(owner, fingerprint)
+    
+    def _save_device_fingerprint(self, owner: str, fingerprint: str) -> None:
+        if self.fingerprint_file is None:
+            return
+        try:
+            self.fingerprint_file.write_text(json.dumps({"owner": owner, "fingerprint": fingerprint}))
+            self.fingerprint_file.chmod(0o600)
+        except OSError as e:
+            print(f"Error saving device fingerprint: {e}")
+    
+    def _compute_device_fingerprint(self) -> str:
+        """Generate device fingerprint for license binding"""
         device_info = {
             "hostname": platform.node(),
             "platform": platform.platform(),
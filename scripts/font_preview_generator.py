@@ -4,9 +4,15 @@ Font Preview Generator for Cursive Terminal Setup
 Creates PNG images showing text samples in different fonts
 """
 import os
+from pathlib import Path
 from PIL import Image, ImageDraw, ImageFont
 import sys
 
+# Run as a script, so make the repository root importable for analytics
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from analytics import timed
+
+@timed("font_preview.create")
 def create_font_preview(font_path, font_name, output_dir="docs/images"):
     """Create a preview image for a font showing cursive text samples"""
     
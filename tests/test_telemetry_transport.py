@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+"""
+Cursive Terminal - Telemetry Transport Tests
+Posts batches to a local stand-in endpoint and checks the decoded payloads
+"""
+
+import gzip
+import json
+import sys
+import tempfile
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Dict, List, Any
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from analytics.telemetry_system import TelemetryCollector, TelemetryTransport
+
+class StandInEndpoint:
+    """Local HTTP endpoint that records decoded requests and replays scripted responses"""
+
+    def __init__(self):
+        self.requests: List[Dict[str, Any]] = []
+        # (status, headers) per request; the last entry repeats
+        self.responses: List[tuple] = [(200, {})]
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self._server.server_address[1]}/collect"
+
+    def _handler(self):
+        endpoint = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                if self.headers.get("Content-Encoding") == "gzip":
+                    body = gzip.decompress(body)
+
+                with endpoint._lock:
+                    endpoint.requests.append({
+                        "headers": dict(self.headers),
+                        "payload": json.loads(body)
+                    })
+                    index = min(len(endpoint.requests), len(endpoint.responses)) - 1
+                    status, headers = endpoint.responses[index]
+
+                self.send_response(status)
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def close(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+def stored_event(session_id: str, event_type: str = "feature_usage",
+                 terminal: str = "iterm2") -> Dict[str, Any]:
+    """Event row in the shape LocalDatabase hands to the transport"""
+    return {
+        "event_type": event_type,
+        "timestamp": "2026-10-18T12:00:00.000+00:00",
+        "session_id": session_id,
+        "user_id_hash": "user-hash",
+        "platform": "Linux 6.1",
+        "terminal": terminal,
+        "font": "Victor Mono",
+        "properties": {"feature": "themes"},
+        "version": "1.0.0"
+    }
+
+class TelemetryTransportTest(unittest.TestCase):
+
+    def setUp(self):
+        self.endpoint = StandInEndpoint()
+        self.transport = TelemetryTransport(self.endpoint.url, "1.0.0",
+                                            protocol="batch", compression="gzip",
+                                            max_batch_size=100)
+
+    def tearDown(self):
+        self.transport.close()
+        self.endpoint.close()
+
+    def test_batch_groups_events_under_session_headers(self):
+        events = [stored_event("a"), stored_event("b"), stored_event("a", "font_installation")]
+
+        self.assertTrue(self.transport.send(events))
+
+        request = self.endpoint.requests[0]
+        self.assertEqual(request["headers"]["Content-Encoding"], "gzip")
+        self.assertEqual(request["headers"][TelemetryTransport.MAX_BATCH_HEADER], "100")
+
+        payload = request["payload"]
+        self.assertEqual(payload["meta"]["protocol"], 2)
+        self.assertEqual(payload["meta"]["client_version"], "1.0.0")
+
+        batches = {batch["header"]["session_id"]: batch for batch in payload["batches"]}
+        self.assertEqual(set(batches), {"a", "b"})
+        self.assertEqual(batches["a"]["header"], {
+            "session_id": "a",
+            "user_id": "user-hash",
+            "platform": "Linux 6.1",
+            "terminal": "iterm2",
+            "version": "1.0.0"
+        })
+        self.assertEqual([event["type"] for event in batches["a"]["events"]],
+                         ["feature_usage", "font_installation"])
+        # Per-session constants travel once in the header, not per event
+        self.assertEqual(set(batches["a"]["events"][0]),
+                         {"type", "timestamp", "font", "properties"})
+        self.assertEqual(batches["b"]["events"][0]["properties"], {"feature": "themes"})
+
+    def test_events_differing_in_terminal_get_separate_headers(self):
+        events = [stored_event("a"), stored_event("a", terminal="kitty")]
+
+        self.assertTrue(self.transport.send(events))
+
+        headers = [batch["header"]["terminal"]
+                   for batch in self.endpoint.requests[0]["payload"]["batches"]]
+        self.assertEqual(sorted(headers), ["iterm2", "kitty"])
+
+    def test_server_max_batch_header_lowers_batch_size(self):
+        self.endpoint.responses = [(200, {TelemetryTransport.MAX_BATCH_HEADER: "25"})]
+
+        self.assertTrue(self.transport.send([stored_event("a")]))
+        self.assertEqual(self.transport.max_batch_size, 25)
+
+        # A larger hint never raises the size again
+        self.endpoint.responses = [(200, {TelemetryTransport.MAX_BATCH_HEADER: "500"})]
+        self.transport.send([stored_event("a")])
+        self.assertEqual(self.transport.max_batch_size, 25)
+        self.assertEqual(self.endpoint.requests[-1]["headers"][TelemetryTransport.MAX_BATCH_HEADER], "100")
+
+    def test_payload_too_large_halves_batch_size(self):
+        self.endpoint.responses = [(413, {})]
+
+        self.assertFalse(self.transport.send([stored_event("a")] * 40))
+        self.assertEqual(self.transport.max_batch_size, 20)
+
+        self.assertFalse(self.transport.send([stored_event("a")] * 20))
+        self.assertEqual(self.transport.max_batch_size, 10)
+
+        # A single event cannot be split further
+        self.transport.max_batch_size = 1
+        self.assertFalse(self.transport.send([stored_event("a")]))
+        self.assertEqual(self.transport.max_batch_size, 1)
+
+class CollectorTransmissionTest(unittest.TestCase):
+
+    def setUp(self):
+        self.endpoint = StandInEndpoint()
+        self.config_dir = tempfile.TemporaryDirectory()
+        self.collector = TelemetryCollector(endpoint=self.endpoint.url, protocol="batch",
+                                            compression="gzip", config_dir=self.config_dir.name)
+        # Retry immediately instead of waiting out the backoff
+        self.collector.backoff.base_delay = 0
+
+    def tearDown(self):
+        self.collector.close()
+        self.endpoint.close()
+        self.config_dir.cleanup()
+
+    def test_rejected_batch_is_resent_at_half_size(self):
+        for i in range(40):
+            self.collector.track_event("feature_usage", {"index": i})
+        self.collector.flush(transmit=False)
+
+        self.endpoint.responses = [(413, {}), (200, {})]
+
+        self.assertFalse(self.collector.transmit_events(40))
+        self.assertTrue(self.collector.transmit_events(40))
+        self.assertTrue(self.collector.transmit_events(40))
+
+        rejected, first, second = [request["payload"] for request in self.endpoint.requests[:3]]
+
+        def indexes(payload):
+            return [event["properties"]["index"]
+                    for batch in payload["batches"] for event in batch["events"]]
+
+        self.assertEqual(len(indexes(rejected)), 40)
+        self.assertEqual(indexes(first), list(range(20)))
+        self.assertEqual(indexes(second), list(range(20, 40)))
+        self.assertEqual(first["batches"][0]["header"]["session_id"], self.collector.session_id)
+        self.assertEqual(self.collector.database.get_untransmitted_events(), [])
+
+if __name__ == "__main__":
+    unittest.main()